@@ -1,21 +1,185 @@
 """API CRUD"""
 
-from typing import Optional
+import os
+import json
+import base64
+import orjson
+import logging
+from itertools import islice
+from typing import Iterable, Optional
 from pydantic import ValidationError
+from pydantic_core import PydanticUndefined
 from sqlmodel import SQLModel, select as _select
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import StreamingResponse
 
-from util import response
+import metrics
+from db import pin_to_primary
+from util import response, serialize_result, encode_value
 from sqlalchemy.engine.row import Row
-from sqlalchemy import and_
+from sqlalchemy import (
+    and_,
+    or_,
+    update,
+    func,
+    literal,
+    bindparam,
+    select as sa_select,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import load_only
 from datetime import datetime
 
 
+logger = logging.getLogger(__name__)
+
+# Upper bound for a single page of get_all
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# Rows fetched per round trip when streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Rows per multi-row INSERT in bulk_create_items
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+_insert_defaults = {}
+
+# Statements for the hot lookups, built once per (model, filter, projection)
+# with bound parameters so every call reuses the same compiled SQL
+_statement_cache = {}
+statement_cache_hits = metrics.counter("api_crud.statement_cache.hits")
+statement_cache_misses = metrics.counter("api_crud.statement_cache.misses")
+
+
 def serialize_row(row: Row) -> dict:
     """Serialize SQLAlchemy Row object to a dictionary"""
     return {column: value for column, value in row._mapping.items()}
 
 
+def written_user_id(db_model, item_id=None, data_obj=None, level=False):
+    """User whose data a write touched, used for read-your-writes pinning"""
+    if level:
+        return item_id
+    if db_model.__tablename__ == "users":
+        return item_id if data_obj is None else data_obj.id
+    return getattr(data_obj, "user_id", None)
+
+
+def cached_statement(key, build):
+    """Statement stored under key, built by build() on first use"""
+    statement = _statement_cache.get(key)
+    if statement is None:
+        statement_cache_misses.inc()
+        statement = _statement_cache[key] = build()
+    else:
+        statement_cache_hits.inc()
+    return statement
+
+
+def encode_cursor(values: list) -> str:
+    """Opaque token for the keyset position after a row"""
+    raw = json.dumps(jsonable_encoder(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str, sort_column) -> list:
+    """Keyset values from a token made by encode_cursor"""
+    sort_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if sort_column.type.python_type is datetime:
+        sort_value = datetime.fromisoformat(sort_value)
+    return [sort_value, last_id]
+
+
+def keyset_query(query, db_model, cursor=None, order_by="id", descending=False):
+    """Order by (order_by, id) and start after the cursor position"""
+    sort_column = getattr(db_model, order_by)
+    keys = [sort_column] if order_by == "id" else [sort_column, db_model.id]
+
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort_column)
+        if descending:
+            after = sort_column < sort_value
+            tie = db_model.id < last_id
+        else:
+            after = sort_column > sort_value
+            tie = db_model.id > last_id
+        if order_by != "id":
+            after = or_(after, and_(sort_column == sort_value, tie))
+        query = query.where(after)
+
+    return query.order_by(*[key.desc() if descending else key for key in keys])
+
+
+def filter_query(query, db_model, filters=None):
+    """Apply equality filters"""
+    if filters:
+        filter_conditions = [
+            getattr(db_model, key) == value for key, value in filters.items()
+        ]
+        query = query.where(and_(*filter_conditions))
+    return query
+
+
+def get_all_statement(db_model, columns=None, filter_keys=()):
+    """Cached unpaginated get_all query, filters bound as filter_<key>"""
+
+    def build():
+        query = _select(db_model)
+        if filter_keys:
+            query = query.where(
+                *[
+                    getattr(db_model, key) == bindparam(f"filter_{key}")
+                    for key in filter_keys
+                ]
+            )
+        if columns:
+            query = load_only_columns(query, db_model, list(columns))
+        return query
+
+    return cached_statement(("get_all", db_model, columns, filter_keys), build)
+
+
+def get_single_statement(db_model, level=False, columns=None):
+    """Cached get_single query, the id bound as item_id"""
+
+    def build():
+        filter_condition = db_model.user_id if level else db_model.id
+        query = _select(db_model).where(filter_condition == bindparam("item_id"))
+        if columns:
+            # Ensure the columns are ORM mapped attributes
+            column_attributes = [getattr(db_model, column) for column in columns]
+            query = query.options(load_only(*column_attributes))
+        return query
+
+    return cached_statement(("get_single", db_model, level, columns), build)
+
+
+def insert_defaults(db_model) -> dict:
+    """Model field defaults as (value, is_factory), computed once per model"""
+    if db_model not in _insert_defaults:
+        defaults = {}
+        for name, field in db_model.model_fields.items():
+            if name == "id":
+                continue
+            if field.default_factory is not None:
+                defaults[name] = (field.default_factory, True)
+            elif field.default not in (None, PydanticUndefined):
+                defaults[name] = (field.default, False)
+        _insert_defaults[db_model] = defaults
+    return _insert_defaults[db_model]
+
+
+def insert_row(db_model, item: dict) -> dict:
+    """Column values for a Core INSERT, with the model defaults filled in"""
+    row = {
+        name: default() if is_factory else default
+        for name, (default, is_factory) in insert_defaults(db_model).items()
+        if name not in item
+    }
+    row.update(item)
+    return row
+
+
 def load_only_columns(
     query: _select,
     entity: SQLModel,
@@ -24,48 +188,111 @@ def load_only_columns(
     """Load only will show selected columns"""
     load_only_columns = [getattr(entity, field) for field in columns]
 
-    query = query.with_entities(*load_only_columns)
+    query = query.with_only_columns(*load_only_columns)
     return query
 
 
-async def get_all(db_model, db, message, columns=None, filters=None):
+async def get_all(
+    db_model,
+    db,
+    message,
+    columns=None,
+    filters=None,
+    cursor=None,
+    limit=None,
+    order_by="id",
+    descending=False,
+):
     try:
-        query = db.query(db_model)
-
-        if filters:
-            filter_conditions = [
-                getattr(db_model, key) == value for key, value in filters.items()
-            ]
-            query = query.filter(and_(*filter_conditions))
-
-        if columns:
-            query = load_only_columns(query, db_model, columns)
-
-        data_obj = query.all()
+        key_columns = []
+        params = {}
+        if limit is not None:
+            query = filter_query(_select(db_model), db_model, filters)
+            if columns:
+                key_columns = [
+                    key for key in dict.fromkeys([order_by, "id"]) if key not in columns
+                ]
+                query = load_only_columns(query, db_model, columns + key_columns)
+            # LIMIT 0 and negative limits are not valid MySQL
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+            query = keyset_query(query, db_model, cursor, order_by, descending)
+            query = query.limit(limit + 1)
+        else:
+            filters = filters or {}
+            query = get_all_statement(
+                db_model, tuple(columns) if columns else None, tuple(filters)
+            )
+            params = {f"filter_{key}": value for key, value in filters.items()}
+
+        result = await db.execute(query, params)
+        data_obj = result.all() if columns else result.scalars().all()
+
+        next_cursor = None
+        if limit and len(data_obj) > limit:
+            data_obj = data_obj[:limit]
+            last_row = data_obj[-1]
+            if columns:
+                last_row = last_row._mapping
+                next_cursor = encode_cursor([last_row[order_by], last_row["id"]])
+            else:
+                next_cursor = encode_cursor(
+                    [getattr(last_row, order_by), last_row.id]
+                )
 
         if not data_obj:
             message = "No data found"
             return response(message, 0, 404, data_obj)
         if columns:
             data_obj = [serialize_row(row) for row in data_obj]
+            for row in data_obj:
+                for key in key_columns:
+                    row.pop(key)
 
-        return response(message, 1, 200, data_obj)
+        response_obj = response(message, 1, 200, data_obj)
+        if limit:
+            response_obj.data["next_cursor"] = next_cursor
+        return response_obj
 
     except Exception as e:
         return response(str(e), 0, 400)
 
 
-async def get_single(db_model, db, id, level=False, columns=None):
-    try:
-        filter_condition = db_model.user_id if level else db_model.id
-        query = db.query(db_model).filter(filter_condition == id)
+async def stream_all(
+    db_model, db, columns=None, filters=None, order_by="id", descending=False
+):
+    """Stream matching rows as NDJSON, STREAM_BATCH_SIZE rows per round trip.
+
+    The status is sent before the first row, so a failure mid-stream ends the
+    body with an {"error": ...} line instead of a row.
+    """
+    query = filter_query(_select(db_model), db_model, filters)
+    if columns:
+        query = load_only_columns(query, db_model, columns)
+    query = keyset_query(query, db_model, None, order_by, descending)
+    query = query.execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    async def rows():
+        try:
+            result = await db.stream(query)
+            if not columns:
+                result = result.scalars()
+            async for row in result:
+                item = serialize_row(row) if columns else serialize_result(row)
+                yield orjson.dumps(item, default=encode_value) + b"\n"
+        except Exception as exc:
+            msg = f"stream {db_model.__tablename__} exception {str(exc)}"
+            logger.exception(msg)
+            yield orjson.dumps({"error": str(exc)}) + b"\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
-        if columns:
-            # Ensure the columns are ORM mapped attributes
-            column_attributes = [getattr(db_model, column) for column in columns]
-            query = query.options(load_only(*column_attributes))
 
-        data_obj = query.first()
+async def get_single(db_model, db, id, level=False, columns=None):
+    try:
+        query = get_single_statement(
+            db_model, level, tuple(columns) if columns else None
+        )
+        data_obj = (await db.execute(query, {"item_id": id})).scalars().first()
         if hasattr(data_obj, "dob"):
             data_obj.dob = data_obj.dob.strftime("%d-%m-%Y")
 
@@ -81,12 +308,26 @@ async def get_single(db_model, db, id, level=False, columns=None):
     return response_obj
 
 
+async def get_modified_at(db_model, db, id, level=False):
+    """modified_at of a single row, the narrow probe behind conditional GETs"""
+
+    def build():
+        filter_condition = db_model.user_id if level else db_model.id
+        return sa_select(db_model.modified_at).where(
+            filter_condition == bindparam("item_id")
+        )
+
+    query = cached_statement(("modified_at", db_model, level), build)
+    return (await db.execute(query, {"item_id": id})).scalar()
+
+
 async def create_new(model_input, db_model, db, message):
     try:
         data_obj = db_model.from_orm(model_input)
         db.add(data_obj)
-        db.commit()
-        db.refresh(data_obj)
+        await db.commit()
+        await db.refresh(data_obj)
+        pin_to_primary(written_user_id(db_model, data_obj=data_obj))
         response_obj = response(message, 1, 201, data_obj)
 
     except (ValidationError, Exception) as exc:
@@ -95,34 +336,137 @@ async def create_new(model_input, db_model, db, message):
     return response_obj
 
 
-def bulk_create_items(model_inputs, db_model, db):
+async def insert_one(db_model, item: dict, db):
+    """Insert one row with a single INSERT and return its id.
+
+    Unlike create_new nothing is read back, the caller gets only the id.
+    Errors propagate so callers can handle duplicate keys.
+    """
+    statement = mysql_insert(db_model.__table__).values(insert_row(db_model, item))
+    result = await db.execute(statement)
+    await db.commit()
+    row_id = result.lastrowid
+    if db_model.__tablename__ == "users":
+        pin_to_primary(row_id)
+    else:
+        pin_to_primary(item.get("user_id"))
+    return row_id
+
+
+async def bulk_create_items(
+    db_model,
+    items: Iterable[dict],
+    db,
+    chunk_size=BULK_CHUNK_SIZE,
+    update_columns=None,
+):
+    """Insert items with one multi-row INSERT per chunk.
+
+    With update_columns the INSERT becomes ON DUPLICATE KEY UPDATE of those
+    columns, and MySQL then counts an updated row as 2 in "inserted".
+    """
     try:
-        db_items = [
-            db_model(
-                loan_id=model_inputs["loan_id"],
-                amount=model_inputs["amount"],
-                date=emi_date,
-            )
-            for emi_date in model_inputs["date"]
-        ]
-        db.bulk_save_objects(db_items)
-        db.commit()
-        db.refresh(db_items)
-        return "items saved successfully"
+        inserted = 0
+        user_ids = set()
+        items = iter(items)
+        while chunk := list(islice(items, chunk_size)):
+            rows = [insert_row(db_model, item) for item in chunk]
+            user_ids.update(row.get("user_id") for row in rows)
+            statement = mysql_insert(db_model.__table__).values(rows)
+            if update_columns:
+                statement = statement.on_duplicate_key_update(
+                    {column: statement.inserted[column] for column in update_columns}
+                )
+            result = await db.execute(statement)
+            inserted += result.rowcount
+        await db.commit()
+        for user_id in user_ids:
+            pin_to_primary(user_id)
+        response_obj = response(
+            "items saved successfully", 1, 201, {"inserted": inserted}
+        )
 
     except (ValidationError, Exception) as exc:
         response_obj = response(str(exc), 0, 400)
     return response_obj
 
 
-async def update_single(item_id, model_input, db_model, db, message, level=False):
+async def upsert_by_user(user_id, model_input, db_model, db, message):
+    """Create or update the user's row of a user_id-unique table in one
+    INSERT ... ON DUPLICATE KEY UPDATE.
+
+    The result holds the row id and the applied fields. Whether the row was
+    created or updated is not reported: with CLIENT_FOUND_ROWS an update that
+    changes nothing has the same rowcount as an insert.
+    """
     try:
-        filter_condition = db_model.user_id if level else db_model.id
-        db_item = db.query(db_model).filter(filter_condition == item_id).first()
+        if isinstance(model_input, dict):
+            input_data = dict(model_input)
+        else:
+            input_data = model_input.dict(exclude_unset=True)
+        input_data["user_id"] = user_id
+
+        table = db_model.__table__
+        statement = mysql_insert(table).values(insert_row(db_model, input_data))
+        updates = {
+            column: statement.inserted[column]
+            for column in input_data
+            if column != "user_id"
+        }
+        updates["modified_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Makes lastrowid the existing row id when the row is updated
+        updates["id"] = func.last_insert_id(table.c.id)
+        statement = statement.on_duplicate_key_update(updates)
+
+        result = await db.execute(statement)
+        await db.commit()
+        pin_to_primary(user_id)
+
+        data = {"id": result.lastrowid, **input_data}
+        response_obj = response(message, 1, 200, data)
 
-        if not db_item:
-            message = "Item not found"
-            return response(message, 404, 0)
+    except (ValidationError, Exception) as exc:
+        response_obj = response(str(exc), 0, 400)
+
+    return response_obj
+
+
+async def create_if_missing(model_input, db_model, db, message):
+    """Insert the user's row only when they do not have one yet, in a single
+    INSERT ... SELECT guarded by NOT EXISTS"""
+    try:
+        row = insert_row(db_model, dict(model_input))
+        table = db_model.__table__
+        existing = (
+            sa_select(table.c.id).where(table.c.user_id == row["user_id"]).exists()
+        )
+        source = sa_select(
+            *[literal(value, table.c[column].type) for column, value in row.items()]
+        ).where(~existing)
+
+        result = await db.execute(mysql_insert(table).from_select(list(row), source))
+        await db.commit()
+        pin_to_primary(row["user_id"])
+
+        status_code = 201 if result.rowcount else 200
+        response_obj = response(message, 1, status_code, row)
+
+    except (ValidationError, Exception) as exc:
+        response_obj = response(str(exc), 0, 400)
+
+    return response_obj
+
+
+async def update_single(
+    item_id, model_input, db_model, db, message, level=False, fetch=False
+):
+    """Apply the fields with one UPDATE statement.
+
+    The result holds the applied fields unless fetch is set, in which case
+    the updated row is read back.
+    """
+    try:
+        filter_condition = db_model.user_id if level else db_model.id
 
         if isinstance(model_input, dict):
             input_data = model_input
@@ -130,11 +474,28 @@ async def update_single(item_id, model_input, db_model, db, message, level=False
             input_data = model_input.dict(exclude_unset=True)
         input_data["modified_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        for key, value in input_data.items():
-            setattr(db_item, key, value)
+        statement = (
+            update(db_model).where(filter_condition == item_id).values(**input_data)
+        )
+        result = await db.execute(statement)
 
-        db.commit()
-        db.refresh(db_item)
+        if not result.rowcount:
+            await db.rollback()
+            message = "Item not found"
+            return response(message, 404, 0)
+
+        await db.commit()
+        pin_to_primary(written_user_id(db_model, item_id, level=level))
+
+        if fetch:
+            query = (
+                _select(db_model)
+                .where(filter_condition == item_id)
+                .execution_options(populate_existing=True)
+            )
+            db_item = (await db.execute(query)).scalars().first()
+        else:
+            db_item = {"user_id" if level else "id": item_id, **input_data}
         response_obj = response(message, 1, 200, db_item)
 
     except (ValidationError, Exception) as exc:
@@ -145,14 +506,16 @@ async def update_single(item_id, model_input, db_model, db, message, level=False
 
 async def delete(item_id, db_model, db):
     try:
-        db_item = db.query(db_model).filter(db_model.id == item_id).first()
+        query = _select(db_model).where(db_model.id == item_id)
+        db_item = (await db.execute(query)).scalars().first()
 
         if not db_item:
             message = "Item not found"
             return response(message, 404, 0)
 
-        db.delete(db_item)
-        db.commit()
+        await db.delete(db_item)
+        await db.commit()
+        pin_to_primary(written_user_id(db_model, item_id, data_obj=db_item))
         response_obj = response(message, 1, 200)
 
     except (ValidationError, Exception) as exc:
@@ -8,13 +8,32 @@ from fastapi.security import (
 from jose import jwt
 from pydantic import BaseModel
 from datetime import timedelta, datetime
-from typing import Union
+from typing import Union, Optional
 from os import environ
+from uuid import uuid4
+from hashlib import sha256
+from collections import OrderedDict
+import time
 from dotenv import load_dotenv
 
+import metrics
+import revocation
+
 
 load_dotenv()
 
+# Key material, read once at startup
+SECRET_HS512_KEY = environ.get("SECRET_HS512_KEY")
+SIGNING_KEY = environ.get("SIGNING_KEY")
+
+# Verified tokens kept in memory so repeat requests skip the HMAC check
+JWT_CACHE_SIZE = int(environ.get("JWT_CACHE_SIZE", "10000"))
+
+_verified_tokens = OrderedDict()
+jwt_cache_hits = metrics.counter("jwt.cache.hits")
+jwt_cache_misses = metrics.counter("jwt.cache.misses")
+metrics.gauge("jwt.cache.size", lambda: len(_verified_tokens))
+
 
 class TokenData(BaseModel):
     """JWT token class"""
@@ -25,6 +44,9 @@ class TokenData(BaseModel):
     user_type: str = "user"
     user_id: int
     email: str
+    jti: Optional[str] = None
+    iat: Optional[int] = None
+    exp: Optional[int] = None
 
     def asdict(self):
         """create dict"""
@@ -47,6 +69,7 @@ class JWTBearer(HTTPBearer):
     async def __call__(self, request: Request):
         if request.query_params.get("_token"):
             token_data = verify_jwt(request.query_params.get("_token"))
+            check_revoked(token_data)
             return token_data
 
         credentials: HTTPAuthorizationCredentials = await super(
@@ -61,23 +84,30 @@ class JWTBearer(HTTPBearer):
             )
 
         token_data = verify_jwt(credentials.credentials)
+        check_revoked(token_data)
 
         return token_data
 
 
+def check_revoked(token_data: TokenData):
+    """Reject a verified token that was revoked, or whose user was"""
+    if revocation.is_revoked(token_data):
+        raise HTTPException(status_code=403, detail="Token has been revoked.")
+
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None]):
     """create access token"""
     to_encode = data.copy()
+    issued_at = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = issued_at + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+        expire = issued_at + timedelta(minutes=15)
+    # jti identifies the token for revocation
+    to_encode.update({"exp": expire, "iat": issued_at, "jti": uuid4().hex})
 
     # Use specific jwt secret to sign the jwt token
-    encoded_jwt = jwt.encode(
-        to_encode, environ.get("SECRET_HS512_KEY"), algorithm=environ.get("SIGNING_KEY")
-    )
+    encoded_jwt = jwt.encode(to_encode, SECRET_HS512_KEY, algorithm=SIGNING_KEY)
     return encoded_jwt
 
 
@@ -108,12 +138,26 @@ def create_service_token(
 
 def verify_jwt(token: str) -> TokenData:
     """Token validation"""
+    digest = sha256(token.encode()).digest()
+    cached = _verified_tokens.get(digest)
+    if cached is not None:
+        token_data, expires_at = cached
+        if expires_at > time.time():
+            jwt_cache_hits.inc()
+            _verified_tokens.move_to_end(digest)
+            return token_data
+        # Expired, decode below rejects it
+        del _verified_tokens[digest]
+
+    jwt_cache_misses.inc()
     try:
         # Passing the token inside credentials.credentials to set env details
-        payload = jwt.decode(
-            token=token, key=environ.get("SECRET_HS512_KEY"), algorithms=["HS512"]
-        )
+        payload = jwt.decode(token=token, key=SECRET_HS512_KEY, algorithms=["HS512"])
         token_data = TokenData(**payload)
+        if payload.get("exp") is not None:
+            _verified_tokens[digest] = (token_data, payload["exp"])
+            if len(_verified_tokens) > JWT_CACHE_SIZE:
+                _verified_tokens.popitem(last=False)
         return token_data
 
     except Exception as ex:
@@ -1,9 +1,12 @@
 """Bunny For media file upload"""
-import requests
+import httpx
 import logging
 from os import environ
 from dotenv import load_dotenv
 
+import http_clients
+from circuit_breaker import ProviderUnavailable
+
 
 load_dotenv()
 
@@ -14,7 +17,7 @@ ACCESS_KEY =environ.get("ACCESS_KEY")
 base_url = environ.get("BASE_URL")
 
 
-def upload_file(file_path, file_name, m):
+async def upload_file(file_path, file_name, m):
     try:
         if m == "p_image":
           dir = "profile_images"
@@ -33,15 +36,20 @@ def upload_file(file_path, file_name, m):
             "accept": "application/json"
         }
         with open(file_path, 'rb') as file_data:
-            response = requests.put(url, headers=headers, data=file_data)
+            response = await http_clients.request(
+                "bunny", "PUT", url, headers=headers, content=file_data.read()
+            )
         print(response.status_code, response.text)
         return response 
+    except ProviderUnavailable as exc:
+        logger.warning(f"upload file bunny {str(exc)}")
+        return httpx.Response(503, text=str(exc))
     except Exception as exc:
         msg = f"upload file bunny exception {str(exc)}"
         logger.exception(msg)
         response(str(exc), 0, 404)
 
-def get_file(file_name, m):
+async def get_file(file_name, m):
     try:
         if m == "p_image":
           dir = "profile_images"
@@ -57,8 +65,11 @@ def get_file(file_name, m):
             "Content-Type": "application/octet-stream",
             "accept": "application/json"
         }
-        response = requests.get(url, headers=headers)
+        response = await http_clients.request("bunny", "GET", url, headers=headers)
         return response
+    except ProviderUnavailable as exc:
+        logger.warning(f"get file bunny {str(exc)}")
+        return httpx.Response(503, text=str(exc))
     except Exception as exc:
         msg = f"get file bunny exception {str(exc)}"
         logger.exception(msg)
@@ -0,0 +1,145 @@
+"""Circuit breaker and bulkhead for external providers"""
+
+import time
+import asyncio
+from collections import deque
+
+import metrics
+
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class ProviderUnavailable(Exception):
+    """Call refused without reaching the provider"""
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class BulkheadFull(ProviderUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Failure and latency based breaker over the last window_size calls.
+
+    Opens when, after at least min_calls, the share of failed calls reaches
+    failure_rate or the share of calls slower than slow_seconds reaches
+    slow_rate. After open_seconds it lets up to probes calls through half
+    open: a failed probe opens it again, probes successes close it.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_rate=0.5,
+        slow_seconds=10.0,
+        slow_rate=0.8,
+        min_calls=10,
+        window_size=50,
+        open_seconds=30.0,
+        probes=3,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.outcomes = deque(maxlen=window_size)
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.opened = metrics.counter(f"circuit.{name}.opened")
+        self.rejected = metrics.counter(f"circuit.{name}.rejected")
+        metrics.gauge(f"circuit.{name}.state", lambda: _STATE_VALUES[self.state])
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go to the provider now"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected.inc()
+                raise CircuitOpen(f"{self.name} unavailable, circuit open")
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.probes:
+                self.rejected.inc()
+                raise CircuitOpen(f"{self.name} unavailable, circuit half open")
+            self.probes_in_flight += 1
+
+    def record(self, failed, duration):
+        """Account a finished call"""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if failed:
+                self.trip()
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.probes:
+                self.state = CLOSED
+                self.outcomes.clear()
+            return
+
+        if self.state == OPEN:
+            return
+
+        self.outcomes.append((failed, duration >= self.slow_seconds))
+        calls = len(self.outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self.outcomes if failed)
+        slow_calls = sum(1 for _, slow in self.outcomes if slow)
+        if (
+            failures / calls >= self.failure_rate
+            or slow_calls / calls >= self.slow_rate
+        ):
+            self.trip()
+
+    def release(self):
+        """Give back the probe slot of a call that ended without an outcome,
+        e.g. cancelled, without counting it as a failure"""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self.opened.inc()
+
+
+class Bulkhead:
+    """Caps the calls in flight to a provider, so a slow one can hold only
+    max_concurrent requests; callers wait at most max_wait for a slot"""
+
+    def __init__(self, name, max_concurrent, max_wait=1.0):
+        self.name = name
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.rejected = metrics.counter(f"bulkhead.{name}.rejected")
+        metrics.gauge(f"bulkhead.{name}.in_flight", lambda: self.in_flight)
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected.inc()
+            raise BulkheadFull(f"{self.name} unavailable, too many calls in flight")
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        self._semaphore.release()
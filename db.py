@@ -1,12 +1,22 @@
 """DB configuration"""
 
 import os
-from sqlalchemy import create_engine
+import time
+from itertools import cycle
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from typing import Generator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import AsyncGenerator
 from sqlmodel import SQLModel, create_engine
 from dotenv import load_dotenv
 
+import metrics
+import query_stats
+
 # Load environment variables from a .env file
 load_dotenv()
 
@@ -17,15 +27,103 @@ DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 DB_PORT = os.getenv("DB_PORT")
 
+DB_URL = f"{DB_USERNAME}:{DB_PASSWORD}@{"192.168.0.12"}:{DB_PORT}/{DB_NAME}"
+
+# Set DB_ECHO=true to see SQL statements being executed
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+# Connection pool settings, sized per worker process
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "3600")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+
+# Comma separated read replica hosts, GET requests are served from them
+DB_REPLICA_HOSTS = [
+    host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()
+]
+
+# Seconds a user keeps reading from the primary after a write, so replica lag
+# never hides their own changes
+REPLICA_PIN_SECONDS = float(os.getenv("DB_REPLICA_PIN_SECONDS", "5"))
+
+# The pin expiry (epoch seconds) goes back to the client on write responses
+# in this cookie and header, and comes back with its next requests, so the
+# pin holds whichever worker serves them
+PRIMARY_PIN_COOKIE = "db_primary_until"
+PRIMARY_PIN_HEADER = "X-DB-Primary-Until"
+
+
+def instrumented_pool(pool_class, name):
+    """Pool class recording checkout wait time and checkout timeouts"""
+    wait_seconds = metrics.histogram(f"db.pool.{name}.checkout_wait_seconds")
+    checkout_timeouts = metrics.counter(f"db.pool.{name}.checkout_timeouts")
+
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                checkout_timeouts.inc()
+                raise
+            finally:
+                wait_seconds.observe(time.perf_counter() - start)
+
+    return InstrumentedPool
+
+
+def register_pool_metrics(name, db_engine):
+    """Expose live pool occupancy of an engine as gauges"""
+    sync_engine = db_engine.sync_engine
+    metrics.gauge(f"db.pool.{name}.size", lambda: sync_engine.pool.size())
+    metrics.gauge(
+        f"db.pool.{name}.checked_out", lambda: sync_engine.pool.checkedout()
+    )
+    metrics.gauge(f"db.pool.{name}.checked_in", lambda: sync_engine.pool.checkedin())
+    metrics.gauge(f"db.pool.{name}.overflow", lambda: sync_engine.pool.overflow())
+
 
 # Create the engine using environment variables
-engine = create_engine(
-    f"mysql+pymysql://{DB_USERNAME}:{DB_PASSWORD}@{"192.168.0.12"}:{DB_PORT}/{DB_NAME}",
-    echo=True,  # Set to True to see SQL statements being executed, False to disable
+engine = create_engine(f"mysql+pymysql://{DB_URL}", echo=DB_ECHO, **POOL_SETTINGS)
+
+# Async engine used by the request handlers so DB round trips do not block
+# the event loop
+async_engine = create_async_engine(
+    f"mysql+aiomysql://{DB_URL}",
+    echo=DB_ECHO,
+    poolclass=instrumented_pool(AsyncAdaptedQueuePool, "primary"),
+    **POOL_SETTINGS,
 )
+register_pool_metrics("primary", async_engine)
+query_stats.instrument(async_engine)
+
+replica_engines = []
+for index, host in enumerate(DB_REPLICA_HOSTS):
+    replica_engine = create_async_engine(
+        f"mysql+aiomysql://{DB_USERNAME}:{DB_PASSWORD}@{host}:{DB_PORT}/{DB_NAME}",
+        echo=DB_ECHO,
+        poolclass=instrumented_pool(AsyncAdaptedQueuePool, f"replica{index}"),
+        **POOL_SETTINGS,
+    )
+    register_pool_metrics(f"replica{index}", replica_engine)
+    query_stats.instrument(replica_engine)
+    replica_engines.append(replica_engine)
+
+_replica_cycle = cycle(replica_engines)
+_primary_pins = {}
+_request_pin = ContextVar("primary_pin", default=None)
+replica_reads = metrics.counter("db.route.replica")
+pinned_reads = metrics.counter("db.route.primary_pinned")
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
 
 
@@ -34,9 +132,75 @@ def create_db_tables():
     SQLModel.metadata.create_all(bind=engine)
 
 
-def get_db() -> Generator:
-    db = SessionLocal()
+class PrimaryPin:
+    """Pin expiry set by the writes of the current request"""
+
+    def __init__(self):
+        self.until = None
+
+
+@contextmanager
+def track_primary_pin():
+    """Collect the pin set by writes inside the block, to hand to the client"""
+    pin = PrimaryPin()
+    token = _request_pin.set(pin)
     try:
-        yield db
+        yield pin
     finally:
-        db.close()
+        _request_pin.reset(token)
+
+
+def pin_to_primary(user_id):
+    """Keep the user's reads on the primary for REPLICA_PIN_SECONDS"""
+    if not replica_engines:
+        return
+    pin = _request_pin.get()
+    if pin is not None:
+        pin.until = time.time() + REPLICA_PIN_SECONDS
+    if user_id is None:
+        return
+    now = time.monotonic()
+    if len(_primary_pins) > 10000:
+        for key, expires_at in list(_primary_pins.items()):
+            if expires_at <= now:
+                del _primary_pins[key]
+    _primary_pins[str(user_id)] = now + REPLICA_PIN_SECONDS
+
+
+def is_pinned_to_primary(user_id):
+    """Whether the user wrote recently enough that replicas may be stale"""
+    if user_id is None:
+        return False
+    expires_at = _primary_pins.get(str(user_id))
+    return expires_at is not None and expires_at > time.monotonic()
+
+
+def client_pinned_to_primary(request: Request):
+    """Whether the client carries a pin from a write on any worker"""
+    value = request.headers.get(PRIMARY_PIN_HEADER) or request.cookies.get(
+        PRIMARY_PIN_COOKIE
+    )
+    try:
+        return value is not None and float(value) > time.time()
+    except ValueError:
+        return False
+
+
+def read_engine(request: Request):
+    """Replica engine for a read-only request, None to use the primary"""
+    if request.method != "GET" or not replica_engines:
+        return None
+    if client_pinned_to_primary(request) or is_pinned_to_primary(
+        request.query_params.get("user_id")
+    ):
+        pinned_reads.inc()
+        return None
+    replica_reads.inc()
+    return next(_replica_cycle)
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    bind = read_engine(request)
+    session = AsyncSessionLocal(bind=bind) if bind else AsyncSessionLocal()
+    async with session as db:
+        yield db
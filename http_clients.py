@@ -0,0 +1,155 @@
+"""Outbound HTTP clients, one keep-alive pool per provider"""
+
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+from circuit_breaker import CircuitBreaker, Bulkhead
+
+
+load_dotenv()
+
+
+class Provider:
+    """Connection settings of an external API, overridable with
+    <PREFIX>_TIMEOUT, _CONNECT_TIMEOUT, _MAX_CONNECTIONS, _MAX_KEEPALIVE and
+    _RETRIES env variables.
+
+    Calls pass a circuit breaker and a bulkhead, tuned with
+    <PREFIX>_BREAKER_FAILURE_RATE, _BREAKER_SLOW_SECONDS, _BREAKER_SLOW_RATE,
+    _BREAKER_MIN_CALLS, _BREAKER_OPEN_SECONDS, _MAX_CONCURRENT and
+    _BULKHEAD_WAIT.
+    """
+
+    def __init__(
+        self,
+        name,
+        prefix,
+        base_url="",
+        timeout=15.0,
+        connect_timeout=3.0,
+        max_connections=50,
+        max_keepalive=20,
+        retries=2,
+        slow_seconds=10.0,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT", timeout))
+        self.connect_timeout = float(
+            os.getenv(f"{prefix}_CONNECT_TIMEOUT", connect_timeout)
+        )
+        self.max_connections = int(
+            os.getenv(f"{prefix}_MAX_CONNECTIONS", max_connections)
+        )
+        self.max_keepalive = int(os.getenv(f"{prefix}_MAX_KEEPALIVE", max_keepalive))
+        # Retries of failed connection attempts only, a request that reached
+        # the provider is never sent again
+        self.retries = int(os.getenv(f"{prefix}_RETRIES", retries))
+        self.latency = metrics.histogram(f"http.{name}.latency_seconds")
+        self.errors = metrics.counter(f"http.{name}.errors")
+        self.timeouts = metrics.counter(f"http.{name}.timeouts")
+        self.client = None
+        self.breaker = CircuitBreaker(
+            name,
+            failure_rate=float(os.getenv(f"{prefix}_BREAKER_FAILURE_RATE", 0.5)),
+            slow_seconds=float(
+                os.getenv(f"{prefix}_BREAKER_SLOW_SECONDS", slow_seconds)
+            ),
+            slow_rate=float(os.getenv(f"{prefix}_BREAKER_SLOW_RATE", 0.8)),
+            min_calls=int(os.getenv(f"{prefix}_BREAKER_MIN_CALLS", 10)),
+            open_seconds=float(os.getenv(f"{prefix}_BREAKER_OPEN_SECONDS", 30)),
+        )
+        self.bulkhead = Bulkhead(
+            name,
+            int(os.getenv(f"{prefix}_MAX_CONCURRENT", self.max_connections)),
+            max_wait=float(os.getenv(f"{prefix}_BULKHEAD_WAIT", 1)),
+        )
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                transport=httpx.AsyncHTTPTransport(
+                    retries=self.retries,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_keepalive,
+                    ),
+                ),
+            )
+        return self.client
+
+
+providers = {
+    provider.name: provider
+    for provider in (
+        # KYC, liveness and credit report calls, the credit report is slow
+        Provider("truthscreen", "TRUTHSCREEN", timeout=30.0, slow_seconds=10.0),
+        Provider("cashfree", "CASHFREE", timeout=15.0, slow_seconds=5.0),
+        # Media upload and download
+        Provider(
+            "bunny", "BUNNY", timeout=60.0, max_connections=20, slow_seconds=20.0
+        ),
+        Provider(
+            "msg91",
+            "MSG91",
+            base_url="https://control.msg91.com",
+            timeout=10.0,
+            slow_seconds=3.0,
+        ),
+    )
+}
+
+
+async def request(provider_name, method, url, **kwargs) -> httpx.Response:
+    """Send a request through the provider's pool, recording its latency.
+
+    Raises circuit_breaker.ProviderUnavailable without calling the provider
+    when its circuit is open or its bulkhead is full. Transport errors and
+    5xx responses count as failures for the breaker, cancelled calls do not
+    count at all.
+    """
+    provider = providers[provider_name]
+    if kwargs.get("headers"):
+        # Unset credentials are left out, as requests did
+        kwargs["headers"] = {
+            key: value for key, value in kwargs["headers"].items() if value is not None
+        }
+    # Checked before waiting for a bulkhead slot, an open circuit fails fast
+    provider.breaker.before_call()
+    outcome = None
+    try:
+        async with provider.bulkhead:
+            start = time.perf_counter()
+            try:
+                result = await provider.get_client().request(method, url, **kwargs)
+            except httpx.TimeoutException:
+                provider.timeouts.inc()
+                outcome = (True, time.perf_counter() - start)
+                raise
+            except httpx.HTTPError:
+                provider.errors.inc()
+                outcome = (True, time.perf_counter() - start)
+                raise
+            outcome = (result.status_code >= 500, time.perf_counter() - start)
+            return result
+    finally:
+        if outcome is None:
+            # Cancelled, refused by the bulkhead or failed before the provider
+            # was reached: no verdict on the provider's health
+            provider.breaker.release()
+        else:
+            failed, duration = outcome
+            provider.latency.observe(duration)
+            provider.breaker.record(failed, duration)
+
+
+async def close():
+    """Close every pool, used at shutdown"""
+    for provider in providers.values():
+        if provider.client is not None:
+            await provider.client.aclose()
@@ -1,11 +1,19 @@
 """Main file"""
 
 
+import math
 import time
+import asyncio
 import logging
 import ipaddress
 
-from routes import user_routes ,otp, subscription
+import db
+import query_stats
+import reference_cache
+import revocation
+import http_clients
+
+from routes import user_routes ,otp, subscription, internal
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
@@ -49,6 +57,40 @@ logging.basicConfig(
 )
 
 
+@app.on_event("startup")
+async def warm_caches():
+    """Load reference data before serving requests and follow invalidations
+    made on other workers"""
+    await reference_cache.warm()
+    app.state.reference_poll = asyncio.create_task(
+        reference_cache.poll_versions_forever()
+    )
+
+
+@app.on_event("shutdown")
+async def stop_reference_poll():
+    app.state.reference_poll.cancel()
+
+
+@app.on_event("startup")
+async def start_revocation_refresh():
+    """Load the token revocation list and keep it in sync with the DB"""
+    await revocation.revocations.refresh()
+    app.state.revocation_refresh = asyncio.create_task(
+        revocation.revocations.refresh_forever()
+    )
+
+
+@app.on_event("shutdown")
+async def stop_revocation_refresh():
+    app.state.revocation_refresh.cancel()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await http_clients.close()
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     msg = f"exception_handler exception {str(exc.errors)}"
@@ -74,6 +116,37 @@ async def ip_whitelist(request: Request, call_next):
     response = await call_next(request)
     return response
 
+@app.middleware("http")
+async def add_query_stats_header(request: Request, call_next):
+    """Add SQL statement count and DB time"""
+
+    with query_stats.track("unmatched") as stats:
+        response = await call_next(request)
+        # Keyed by route template, raw paths would add a histogram per id
+        route = request.scope.get("route")
+        if route is not None:
+            stats.name = route.path
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time"] = str(stats.duration)
+    return response
+
+@app.middleware("http")
+async def carry_primary_pin(request: Request, call_next):
+    """Hand the read-your-writes pin of a write back to the client"""
+
+    with db.track_primary_pin() as pin:
+        response = await call_next(request)
+    if pin.until is not None:
+        until = f"{pin.until:.3f}"
+        response.headers[db.PRIMARY_PIN_HEADER] = until
+        response.set_cookie(
+            db.PRIMARY_PIN_COOKIE,
+            until,
+            max_age=math.ceil(db.REPLICA_PIN_SECONDS),
+            httponly=True,
+        )
+    return response
+
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     """Add process time"""
@@ -97,3 +170,6 @@ def read_root():
 app.include_router(prefix="/user", router=user_routes.router)
 app.include_router(prefix="/otp", router=otp.router, tags=["OTP"])
 app.include_router(prefix="/subscription", router=subscription.router, tags=["Subscription"])
+app.include_router(
+    prefix="/internal", router=internal.router, tags=["Internal"], include_in_schema=False
+)
@@ -0,0 +1,81 @@
+"""In-process metrics"""
+
+import threading
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+
+class Histogram:
+    """Bucketed histogram of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with _lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+def counter(name):
+    """Get or create the counter registered under name"""
+    with _lock:
+        return _counters.setdefault(name, Counter())
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS):
+    """Get or create the histogram registered under name"""
+    with _lock:
+        return _histograms.setdefault(name, Histogram(buckets))
+
+
+def gauge(name, callback):
+    """Register a callback that reports a live value on every snapshot"""
+    with _lock:
+        _gauges[name] = callback
+
+
+def snapshot():
+    """Current value of every registered metric"""
+    return {
+        "counters": {name: item.value for name, item in list(_counters.items())},
+        "gauges": {name: callback() for name, callback in list(_gauges.items())},
+        "histograms": {
+            name: item.snapshot() for name, item in list(_histograms.items())
+        },
+    }
@@ -0,0 +1,21 @@
+-- Token revocation list (revocation.py, models/user/revoked_tokens.py)
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id INTEGER NOT NULL AUTO_INCREMENT,
+    -- jti claim of the revoked token, NULL when every token of the user
+    -- issued before created_at is revoked
+    jti VARCHAR(32) NULL,
+    user_id INTEGER NULL,
+    expires_at TIMESTAMP NULL,
+    reason VARCHAR(255) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE INDEX ix_revoked_tokens_id ON revoked_tokens (id);
+CREATE INDEX idx_revoked_token_jti ON revoked_tokens (jti);
+CREATE INDEX idx_revoked_token_user ON revoked_tokens (user_id);
+
+-- Blocked users are loaded into the revocation list on every refresh
+CREATE INDEX ix_users_is_blocked ON users (is_blocked);
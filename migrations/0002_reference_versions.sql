@@ -0,0 +1,17 @@
+-- Reference cache versions (reference_cache.py, models/user/reference_versions.py)
+
+CREATE TABLE IF NOT EXISTS reference_versions (
+    name VARCHAR(50) NOT NULL,
+    -- Bumped by /internal/reference/invalidate, every worker reloads the
+    -- table once it sees a new version
+    version INTEGER NOT NULL DEFAULT 0,
+    modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (name)
+);
+
+INSERT IGNORE INTO reference_versions (name, version) VALUES
+    ('banks', 0),
+    ('schools', 0),
+    ('loan_types', 0),
+    ('business_types', 0),
+    ('business_natures', 0);
@@ -0,0 +1,25 @@
+"""Reference data version model"""
+
+from datetime import datetime
+from sqlmodel import Field, TIMESTAMP, text, Column, SQLModel
+
+
+class ReferenceVersion(SQLModel, table=True):
+    # Table name
+    __tablename__ = "reference_versions"
+
+    # Reference cache name, e.g. banks
+    name: str = Field(default=None, max_length=50, primary_key=True)
+
+    # Bumped on every invalidation, workers reload when it changes
+    version: int = Field(default=0, nullable=False)
+
+    # Last invalidation date
+    modified_at: datetime = Field(
+        sa_column=Column(
+            TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=text("CURRENT_TIMESTAMP"),
+        ),
+        default_factory=datetime.utcnow,
+    )
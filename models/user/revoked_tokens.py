@@ -0,0 +1,46 @@
+"""Revoked token model"""
+
+from typing import Optional
+from datetime import datetime
+from sqlmodel import Field, TIMESTAMP, text, Column, Index, SQLModel
+
+
+class RevokedTokenIn(SQLModel):
+
+    # jti claim of the revoked token, empty when every token of the user issued
+    # before created_at is revoked
+    jti: Optional[str] = Field(default=None, max_length=32, nullable=True)
+
+    # User id
+    user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+
+    # Expiry of the revoked token, the row is not needed after it
+    expires_at: Optional[datetime] = Field(
+        sa_column=Column(TIMESTAMP(timezone=True), nullable=True), default=None
+    )
+
+    # Why the token was revoked
+    reason: Optional[str] = Field(default=None, max_length=255, nullable=True)
+
+
+class RevokedToken(RevokedTokenIn, table=True):
+    # Table name
+    __tablename__ = "revoked_tokens"
+
+    # Id
+    id: Optional[int] = Field(default=None, index=True, primary_key=True)
+
+    # Revocation date
+    created_at: datetime = Field(
+        sa_column=Column(
+            TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=text("CURRENT_TIMESTAMP"),
+        ),
+        default_factory=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        Index("idx_revoked_token_jti", "jti"),
+        Index("idx_revoked_token_user", "user_id"),
+    )
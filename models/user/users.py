@@ -72,7 +72,8 @@ class Users(UserOut, table=True):
 
     is_admin: bool = Field(default=False)
 
-    is_blocked: bool = Field(default=False)
+    # Indexed for the revocation list refresh
+    is_blocked: bool = Field(default=False, index=True)
 
     is_staff: bool = Field(default=False)
 
@@ -0,0 +1,142 @@
+"""OTP send throttling and deduplication"""
+
+import os
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+
+# Token bucket per mobile number: OTP_BURST sends at once, then one more
+# every OTP_REFILL_SECONDS
+OTP_BURST = int(os.getenv("OTP_BURST", "3"))
+OTP_REFILL_SECONDS = float(os.getenv("OTP_REFILL_SECONDS", "60"))
+
+# Seconds a sent OTP is answered from the pending state instead of sending
+# another one
+OTP_DEDUP_SECONDS = float(os.getenv("OTP_DEDUP_SECONDS", "30"))
+
+throttled = metrics.counter("otp.throttled")
+deduplicated = metrics.counter("otp.deduplicated")
+
+
+class ThrottleStore(ABC):
+    """Bucket and pending state storage, implemented over a store shared by
+    all workers (e.g. Redis) to throttle across processes"""
+
+    @abstractmethod
+    async def take(self, key, burst, refill_seconds) -> float:
+        """Take a token, return 0 on success or the seconds until one refills"""
+
+    @abstractmethod
+    async def get_pending(self, key):
+        """Pending send result stored under key, None once expired"""
+
+    @abstractmethod
+    async def set_pending(self, key, value, ttl):
+        """Store a send result under key for ttl seconds"""
+
+    @abstractmethod
+    async def clear_pending(self, key):
+        """Drop the pending send result under key"""
+
+
+class MemoryThrottleStore(ThrottleStore):
+    """Process local store"""
+
+    max_entries = 100000
+
+    def __init__(self):
+        self.buckets = {}
+        self.pending = {}
+
+    def _prune(self, now):
+        if len(self.buckets) > self.max_entries:
+            for key, (tokens, updated_at) in list(self.buckets.items()):
+                if now - updated_at > OTP_BURST * OTP_REFILL_SECONDS:
+                    del self.buckets[key]
+        if len(self.pending) > self.max_entries:
+            for key, (value, expires_at) in list(self.pending.items()):
+                if expires_at <= now:
+                    del self.pending[key]
+
+    async def take(self, key, burst, refill_seconds) -> float:
+        now = time.monotonic()
+        self._prune(now)
+        tokens, updated_at = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) / refill_seconds)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) * refill_seconds
+        self.buckets[key] = (tokens - 1, now)
+        return 0
+
+    async def get_pending(self, key):
+        entry = self.pending.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def set_pending(self, key, value, ttl):
+        self.pending[key] = (value, time.monotonic() + ttl)
+
+    async def clear_pending(self, key):
+        self.pending.pop(key, None)
+
+
+class OTPThrottle:
+    """Decides whether an OTP request goes to the provider.
+
+    Repeats within OTP_DEDUP_SECONDS of a successful send get the stored
+    provider response back, concurrent repeats wait for the call in flight,
+    and the rest spend a token from the number's bucket.
+    """
+
+    def __init__(self, store: ThrottleStore):
+        self.store = store
+        self._in_flight = {}
+
+    async def run(self, kind, mobile, send):
+        """Result of send() for the number, or of the pending send it repeats.
+
+        Returns (result, retry_after), retry_after is set and result None when
+        the number is throttled.
+        """
+        key = f"{kind}:{mobile}"
+        pending = await self.store.get_pending(key)
+        if pending is not None:
+            deduplicated.inc()
+            return pending, 0
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            deduplicated.inc()
+            return await asyncio.shield(in_flight), 0
+
+        retry_after = await self.store.take(
+            str(mobile), OTP_BURST, OTP_REFILL_SECONDS
+        )
+        if retry_after:
+            throttled.inc()
+            return None, retry_after
+
+        in_flight = self._in_flight[key] = asyncio.ensure_future(send())
+        try:
+            result = await asyncio.shield(in_flight)
+        finally:
+            self._in_flight.pop(key, None)
+        if isinstance(result, dict) and result.get("type") == "success":
+            await self.store.set_pending(key, result, OTP_DEDUP_SECONDS)
+        return result, 0
+
+    async def clear(self, mobile):
+        """Forget pending sends once the number is verified"""
+        for kind in ("send", "resend"):
+            await self.store.clear_pending(f"{kind}:{mobile}")
+
+
+otp_throttle = OTPThrottle(MemoryThrottleStore())
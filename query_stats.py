@@ -0,0 +1,118 @@
+"""Per-request SQL statistics"""
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Level of the slow query and budget warnings, set on this logger so they
+# are written even when the app only logs errors
+QUERY_LOG_LEVEL = os.getenv("QUERY_LOG_LEVEL", "WARNING").upper()
+logger.setLevel(QUERY_LOG_LEVEL)
+
+# Statements slower than this are logged with their parameter shape
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+# Max statements per request, 0 disables the budget
+QUERY_BUDGET = int(os.getenv("DB_QUERY_BUDGET", "0"))
+
+# Raise instead of logging when a request goes over budget (used by tests)
+QUERY_BUDGET_STRICT = os.getenv("DB_QUERY_BUDGET_STRICT", "false").lower() == "true"
+
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+
+query_seconds = metrics.histogram("db.query.seconds")
+slow_queries = metrics.counter("db.query.slow")
+budget_exceeded = metrics.counter("db.query.budget_exceeded")
+
+_current = ContextVar("query_stats", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a tracked block runs more statements than its budget"""
+
+
+class QueryStats:
+    """Statements run and DB time spent inside a tracked block"""
+
+    def __init__(self, name, budget=0):
+        self.name = name
+        self.budget = budget
+        self.count = 0
+        self.duration = 0.0
+
+
+def parameter_shape(parameters):
+    """Types of the bound parameters, never their values"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    query_seconds.observe(elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc()
+        logger.warning(
+            "slow query %.1fms: %s params=%s",
+            elapsed * 1000,
+            statement,
+            parameter_shape(parameters),
+        )
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+
+
+def instrument(db_engine):
+    """Attach statement timing listeners to an engine"""
+    sync_engine = getattr(db_engine, "sync_engine", db_engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def track(name, budget=QUERY_BUDGET, strict=QUERY_BUDGET_STRICT):
+    """Count statements run inside the block and enforce the query budget.
+
+    The block may rename stats once it knows a better name, the histogram
+    is keyed by the final one.
+    """
+    stats = QueryStats(name, budget)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        metrics.histogram(f"db.request.{stats.name}.queries", COUNT_BUCKETS).observe(
+            stats.count
+        )
+
+    if stats.budget and stats.count > stats.budget:
+        budget_exceeded.inc()
+        msg = f"{stats.name} ran {stats.count} queries, budget is {stats.budget}"
+        if strict:
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
@@ -0,0 +1,196 @@
+"""Reference data cache"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, update
+from dotenv import load_dotenv
+
+import metrics
+from db import AsyncSessionLocal
+from search_index import TrigramIndex
+from models.user.bank_npci import NPCIBank
+from models.user.schools import SchoolName
+from models.user.loan_types import LoanType
+from models.user.business_types import BusinessType
+from models.user.business_natures import BusinessNature
+from models.user.reference_versions import ReferenceVersion
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a cached table is read again
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "3600"))
+
+# Seconds between reads of reference_versions, so an invalidation made on
+# one worker reaches the others
+REFERENCE_VERSION_POLL_SECONDS = float(
+    os.getenv("REFERENCE_VERSION_POLL_SECONDS", "10")
+)
+
+
+class ReferenceCache:
+    """Rows of a near-static table held in memory with a TTL"""
+
+    def __init__(self, name, db_model, columns=None, ttl=REFERENCE_CACHE_TTL):
+        self.name = name
+        self.db_model = db_model
+        self.columns = columns
+        self.ttl = ttl
+        self.rows = None
+        self.loaded_at = None
+        self.version = 0
+        # Last reference_versions value seen for this table
+        self.shared_version = None
+        self.listeners = []
+        self._views = {}
+        self._lock = asyncio.Lock()
+        self.hits = metrics.counter(f"reference_cache.{name}.hits")
+        self.misses = metrics.counter(f"reference_cache.{name}.misses")
+        metrics.gauge(
+            f"reference_cache.{name}.rows", lambda: len(self.rows or ())
+        )
+
+    def is_fresh(self):
+        return (
+            self.rows is not None
+            and self.loaded_at is not None
+            and time.monotonic() - self.loaded_at < self.ttl
+        )
+
+    async def get(self, db=None) -> list:
+        """Cached rows as dicts, read from the DB when missing or expired"""
+        if self.is_fresh():
+            self.hits.inc()
+            return self.rows
+
+        self.misses.inc()
+        async with self._lock:
+            if not self.is_fresh():
+                await self.load(db)
+        return self.rows
+
+    async def load(self, db=None):
+        """Read the table and notify listeners"""
+        table = self.db_model.__table__
+        columns = [table.c[column] for column in self.columns or table.c.keys()]
+        query = select(*columns).order_by(table.c.id)
+
+        if db is None:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(query)
+        else:
+            result = await db.execute(query)
+
+        rows = [dict(row._mapping) for row in result]
+        self.rows = rows
+        self.loaded_at = time.monotonic()
+        self.version += 1
+        self._views = {}
+        for listener in self.listeners:
+            listener(rows)
+
+    async def view(self, key, build, db=None):
+        """Value derived from the rows by build(rows), kept until next load"""
+        rows = await self.get(db)
+        cached = self._views.get(key)
+        if cached is None or cached[0] != self.version:
+            cached = self._views[key] = (self.version, build(rows))
+        return cached[1]
+
+    def on_load(self, listener):
+        """Call listener(rows) every time the table is (re)loaded"""
+        self.listeners.append(listener)
+
+    def invalidate(self):
+        """Force a reload on next access"""
+        self.loaded_at = None
+
+
+banks = ReferenceCache("banks", NPCIBank, ["id", "bank_name"])
+schools = ReferenceCache("schools", SchoolName, ["id", "name"])
+loan_types = ReferenceCache("loan_types", LoanType)
+business_types = ReferenceCache("business_types", BusinessType, ["id", "name"])
+business_natures = ReferenceCache("business_natures", BusinessNature, ["id", "name"])
+
+# Fuzzy school name search, kept in step with the schools table
+school_index = TrigramIndex("name")
+schools.on_load(school_index.refresh)
+
+caches = {
+    cache.name: cache
+    for cache in (banks, schools, loan_types, business_types, business_natures)
+}
+
+
+async def warm():
+    """Load every reference table, used at startup"""
+    for cache in caches.values():
+        try:
+            await cache.load()
+        except Exception as exc:
+            msg = f"warm reference cache {cache.name} exception {str(exc)}"
+            logger.exception(msg)
+
+
+def invalidate(name=None):
+    """Invalidate one reference table, or all of them, on this worker"""
+    for cache in caches.values() if name is None else [caches[name]]:
+        cache.invalidate()
+
+
+async def broadcast_invalidate(db, name=None):
+    """Invalidate here and bump reference_versions, so every other worker
+    reloads on its next poll"""
+    invalidate(name)
+    names = list(caches) if name is None else [name]
+    for cache_name in names:
+        result = await db.execute(
+            update(ReferenceVersion)
+            .where(ReferenceVersion.name == cache_name)
+            .values(
+                version=ReferenceVersion.version + 1, modified_at=datetime.utcnow()
+            )
+        )
+        if not result.rowcount:
+            db.add(ReferenceVersion(name=cache_name, version=1))
+    await db.commit()
+
+
+async def poll_versions(db=None):
+    """Invalidate the tables whose reference_versions row changed since the
+    last poll"""
+    query = select(ReferenceVersion.name, ReferenceVersion.version)
+    if db is None:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(query)).all()
+    else:
+        rows = (await db.execute(query)).all()
+
+    for row in rows:
+        cache = caches.get(row.name)
+        if cache is None:
+            continue
+        if cache.shared_version is not None and cache.shared_version != row.version:
+            cache.invalidate()
+        cache.shared_version = row.version
+
+
+async def poll_versions_forever():
+    """poll_versions every REFERENCE_VERSION_POLL_SECONDS until cancelled,
+    logging only the first failure of a run"""
+    failing = False
+    while True:
+        try:
+            await poll_versions()
+            failing = False
+        except Exception as exc:
+            if not failing:
+                msg = f"poll reference versions exception {str(exc)}"
+                logger.error(msg)
+            failing = True
+        await asyncio.sleep(REFERENCE_VERSION_POLL_SECONDS)
@@ -0,0 +1,192 @@
+"""JWT revocation list"""
+
+import os
+import math
+import asyncio
+import logging
+from hashlib import sha256
+from datetime import datetime, timezone
+from sqlalchemy import select, or_
+from dotenv import load_dotenv
+
+import metrics
+from db import AsyncSessionLocal
+from models.user.users import Users
+from models.user.revoked_tokens import RevokedToken
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reloads of the revocation list, so revocations made by
+# other workers are picked up
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+
+# Every token of a blocked user is revoked, whenever it was issued
+ALL_TOKENS = math.inf
+
+
+def as_timestamp(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class BloomFilter:
+    """Bit array set membership filter, false positives but no false negatives"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1024)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing, k positions from two halves of one digest
+        digest = sha256(key.encode()).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        return [
+            (first + index * second) % self.size for index in range(self.hash_count)
+        ]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RevocationList:
+    """Revoked tokens and users mirrored from the DB.
+
+    Lookups never touch the DB: a token's jti goes through the Bloom filter
+    and, only when it might be revoked, the exact set. Users map to the time
+    of their revocation, tokens issued up to then are rejected.
+    """
+
+    def __init__(self):
+        self.jtis = set()
+        self.bloom = BloomFilter(0)
+        self.users = {}
+        self.failing = False
+        self.revoked = metrics.counter("revocation.rejected")
+        self.refresh_failures = metrics.counter("revocation.refresh_failures")
+        self.bloom_false_positives = metrics.counter("revocation.bloom_false_positives")
+        metrics.gauge("revocation.tokens", lambda: len(self.jtis))
+        metrics.gauge("revocation.users", lambda: len(self.users))
+
+    def is_revoked(self, token_data) -> bool:
+        """Whether the verified token must be rejected"""
+        jti = getattr(token_data, "jti", None)
+        if jti is not None and jti in self.bloom:
+            if jti in self.jtis:
+                self.revoked.inc()
+                return True
+            self.bloom_false_positives.inc()
+
+        revoked_at = self.users.get(token_data.user_id)
+        if revoked_at is None:
+            return False
+        # Tokens issued before jti and iat were added cannot be told apart
+        issued_at = getattr(token_data, "iat", None)
+        if issued_at is None or issued_at <= revoked_at:
+            self.revoked.inc()
+            return True
+        return False
+
+    def add_token(self, jti):
+        self.jtis.add(jti)
+        self.bloom.add(jti)
+
+    def add_user(self, user_id, revoked_at):
+        self.users[user_id] = max(self.users.get(user_id, 0), revoked_at)
+
+    async def load(self, db=None):
+        """Replace the in-memory list with the unexpired DB entries"""
+        revoked_query = select(
+            RevokedToken.jti, RevokedToken.user_id, RevokedToken.created_at
+        ).where(
+            or_(
+                RevokedToken.expires_at.is_(None),
+                RevokedToken.expires_at > datetime.utcnow(),
+            )
+        )
+        blocked_query = select(Users.id).where(Users.is_blocked == True)
+
+        if db is None:
+            async with AsyncSessionLocal() as session:
+                revoked_rows = (await session.execute(revoked_query)).all()
+                blocked_ids = (await session.scalars(blocked_query)).all()
+        else:
+            revoked_rows = (await db.execute(revoked_query)).all()
+            blocked_ids = (await db.scalars(blocked_query)).all()
+
+        jtis = {row.jti for row in revoked_rows if row.jti}
+        bloom = BloomFilter(len(jtis))
+        for jti in jtis:
+            bloom.add(jti)
+        users = {}
+        for row in revoked_rows:
+            if row.jti is None and row.user_id is not None:
+                revoked_at = as_timestamp(row.created_at)
+                users[row.user_id] = max(users.get(row.user_id, 0), revoked_at)
+        for user_id in blocked_ids:
+            users[user_id] = ALL_TOKENS
+
+        self.jtis, self.bloom, self.users = jtis, bloom, users
+
+    async def refresh(self):
+        """load() that keeps the current list on failure.
+
+        Only the first failure of a run is logged, so a missing
+        revoked_tokens table (migrations/0001_revoked_tokens.sql not applied)
+        gives one error instead of one per refresh.
+        """
+        try:
+            await self.load()
+        except Exception as exc:
+            if not self.failing:
+                msg = f"refresh revocation list exception {str(exc)}"
+                logger.error(msg)
+            self.failing = True
+            self.refresh_failures.inc()
+            return
+        if self.failing:
+            logger.error("refresh revocation list recovered")
+        self.failing = False
+
+    async def refresh_forever(self):
+        """Reload every REVOCATION_REFRESH_SECONDS until cancelled"""
+        while True:
+            await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
+            await self.refresh()
+
+
+revocations = RevocationList()
+
+
+def is_revoked(token_data) -> bool:
+    return revocations.is_revoked(token_data)
+
+
+async def revoke_token(db, jti, user_id=None, expires_at=None, reason=None):
+    """Revoke a single token by its jti claim"""
+    db.add(
+        RevokedToken(jti=jti, user_id=user_id, expires_at=expires_at, reason=reason)
+    )
+    await db.commit()
+    revocations.add_token(jti)
+
+
+async def revoke_user(db, user_id, reason=None):
+    """Revoke every token issued to the user until now"""
+    revoked_token = RevokedToken(user_id=user_id, reason=reason)
+    db.add(revoked_token)
+    await db.commit()
+    revocations.add_user(user_id, as_timestamp(revoked_token.created_at))
@@ -0,0 +1,77 @@
+"""Internal operational endpoints"""
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+import metrics
+import revocation
+import reference_cache
+from base_jwt import JWTBearer
+from db import get_db
+from models.user.users import Users, UserType
+from util import response
+
+
+async def require_staff(
+    token_data: BaseModel = Depends(JWTBearer()), db: AsyncSession = Depends(get_db)
+):
+    """Limit the internal endpoints to admin and staff users, checked against
+    users since token claims never carry a role"""
+    user = (
+        await db.execute(
+            select(
+                Users.user_type, Users.is_admin, Users.is_staff, Users.is_superuser
+            ).where(Users.id == token_data.user_id, Users.is_blocked == False)
+        )
+    ).first()
+    if user is None or not (
+        user.is_admin
+        or user.is_staff
+        or user.is_superuser
+        or user.user_type in (UserType.admin, UserType.staff)
+    ):
+        raise HTTPException(status_code=403, detail="Not allowed.")
+    return token_data
+
+
+router = APIRouter(dependencies=[Depends(require_staff)])
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return response("Metrics", 1, 200, metrics.snapshot())
+
+
+@router.post("/reference/invalidate")
+async def invalidate_reference_data(
+    name: str = None, db: AsyncSession = Depends(get_db)
+):
+    if name is not None and name not in reference_cache.caches:
+        return response("Unknown reference table", 0, 404)
+    try:
+        await reference_cache.broadcast_invalidate(db, name)
+        return response("Reference data invalidated", 1, 200)
+    except Exception as exc:
+        return response(str(exc), 0, 404)
+
+
+@router.post("/tokens/revoke")
+async def revoke_token(
+    jti: str, user_id: int = None, db: AsyncSession = Depends(get_db)
+):
+    try:
+        await revocation.revoke_token(db, jti, user_id, reason="internal")
+        return response("Token revoked", 1, 200)
+    except Exception as exc:
+        return response(str(exc), 0, 404)
+
+
+@router.post("/users/{user_id}/revoke")
+async def revoke_user_tokens(user_id: int, db: AsyncSession = Depends(get_db)):
+    try:
+        await revocation.revoke_user(db, user_id, reason="internal")
+        return response("User tokens revoked", 1, 200)
+    except Exception as exc:
+        return response(str(exc), 0, 404)
@@ -3,22 +3,26 @@
 from fastapi import APIRouter, Depends
 import logging
 import json
-import http.client
+import math
 from util import response
 from base_jwt import create_service_token
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
 from models.user.users import Users
 from models.user.user_consents import UserConsentIfo
 from util import response
 from db import get_db
-from api_crud import create_new
+from api_crud import insert_one
+from otp_throttle import otp_throttle
+import http_clients
 from os import environ
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
-conn = http.client.HTTPSConnection("control.msg91.com")
 logger = logging.getLogger(__name__)
 
 
@@ -26,9 +30,27 @@ OTP_TEMPLATE_ID = environ.get("OTP_TEMPLATE_ID")
 OTP_AUTH_KEY = environ.get("OTP_AUTH_KEY")
 headers = {"Content-Type": "application/JSON"}
 
+# User and consent status for a login, one statement
+_login_columns = (Users.id, Users.full_name, Users.email, UserConsentIfo.status)
+login_by_mobile = (
+    select(*_login_columns)
+    .outerjoin(UserConsentIfo, UserConsentIfo.user_id == Users.id)
+    .where(Users.mobile == bindparam("mobile"))
+)
+
 router = APIRouter()
 
 
+def throttled_response(retry_after):
+    message = f"Too many OTP requests, retry in {math.ceil(retry_after)} seconds"
+    return response(message, 0, 429)
+
+
+async def find_login(mobile: str, db: AsyncSession):
+    """id, full_name, email and consent status of the user with the mobile"""
+    return (await db.execute(login_by_mobile, {"mobile": mobile})).first()
+
+
 @router.post("/send")
 async def send(name: str, mobile: int):
     try:
@@ -36,16 +58,21 @@ async def send(name: str, mobile: int):
             return response("Invalid mobile number", 0, 422)
 
         payload = json.dumps({"name": name})
-        conn.request(
-            "POST",
-            f"/api/v5/otp?template_id={OTP_TEMPLATE_ID}&otp_length=6&mobile=91{mobile}&authkey={OTP_AUTH_KEY}&realTimeResponse=1",
-            payload,
-            headers,
-        )
 
-        res = conn.getresponse()
-        data = res.read()
-        return json.loads(data.decode("utf-8"))
+        async def send_otp():
+            res = await http_clients.request(
+                "msg91",
+                "POST",
+                f"/api/v5/otp?template_id={OTP_TEMPLATE_ID}&otp_length=6&mobile=91{mobile}&authkey={OTP_AUTH_KEY}&realTimeResponse=1",
+                content=payload,
+                headers=headers,
+            )
+            return res.json()
+
+        result, retry_after = await otp_throttle.run("send", mobile, send_otp)
+        if retry_after:
+            return throttled_response(retry_after)
+        return result
 
     except Exception as exc:
         msg = f"send otp exception {str(exc)}"
@@ -55,23 +82,24 @@ async def send(name: str, mobile: int):
 
 @router.post("/verify")
 async def verify(
-    full_name: str, otp: int, mobile: int, fcm_token: str, db: Session = Depends(get_db)
+    full_name: str, otp: int, mobile: int, fcm_token: str, db: AsyncSession = Depends(get_db)
 ):
     try:
         if len(str(mobile)) != 10:
             return response("Invalid mobile number", 0, 422)
         headers = {"authkey": OTP_AUTH_KEY}
 
-        conn.request(
-            "GET", f"/api/v5/otp/verify?otp={otp}&mobile=91{mobile}", headers=headers
+        res = await http_clients.request(
+            "msg91",
+            "GET",
+            f"/api/v5/otp/verify?otp={otp}&mobile=91{mobile}",
+            headers=headers,
         )
-
-        res = conn.getresponse()
-        data = res.read()
-        result = json.loads(data.decode("utf-8"))
+        result = res.json()
         if "error" == result["type"]:
             return response(result["message"], 0, 400)
-        user_exist = db.query(Users).filter(Users.mobile == mobile).first()
+        await otp_throttle.clear(mobile)
+        user_exist = await find_login(str(mobile), db)
         user_consent_status = None
         if user_exist:
             if user_exist.email == None:
@@ -79,31 +107,37 @@ async def verify(
             else:
                 email = user_exist.email
             jwt_token = create_service_token(
-                user_exist.full_name, user_exist.mobile, user_exist.id, email
+                user_exist.full_name, str(mobile), user_exist.id, email
             )
             user_id = user_exist.id
-            user_consent_status = (
-                db.query(UserConsentIfo.status)
-                .filter(UserConsentIfo.user_id == user_id)
-                .first()
-            )
+            user_consent_status = user_exist.status
         else:
             payload = {
                 "full_name": full_name,
                 "mobile": str(mobile),
                 "fcm_token": fcm_token,
             }
-            response_obj = await create_new(payload, Users, db, message="")
-            user_id = dict(response_obj.data["result"])["id"]
-            jwt_token = create_service_token(
-                full_name, str(mobile), user_id, "dummy@gmail.com"
-            )
+            try:
+                user_id = await insert_one(Users, payload, db)
+                jwt_token = create_service_token(
+                    full_name, str(mobile), user_id, "dummy@gmail.com"
+                )
+            except IntegrityError:
+                # Registered by a concurrent verify of the same number
+                await db.rollback()
+                user_exist = await find_login(str(mobile), db)
+                user_id = user_exist.id
+                jwt_token = create_service_token(
+                    user_exist.full_name,
+                    str(mobile),
+                    user_id,
+                    user_exist.email or "dummy@gmail.com",
+                )
+                user_consent_status = user_exist.status
         data = {
             "jwt_token": jwt_token,
             "user_id": user_id,
-            "user_consent_status": (
-                user_consent_status[0] if user_consent_status else False
-            ),
+            "user_consent_status": user_consent_status or False,
         }
         return response(result["message"], 1, 200, data)
 
@@ -118,16 +152,19 @@ async def resend(mobile: int):
     try:
         if len(str(mobile)) != 10:
             return response("Invalid mobile number", 0, 422)
-        conn = http.client.HTTPSConnection("control.msg91.com")
 
-        conn.request(
-            "GET",
-            f"/api/v5/otp/retry?authkey={OTP_AUTH_KEY}&retrytype=1&mobile=91{mobile}",
-        )
+        async def resend_otp():
+            res = await http_clients.request(
+                "msg91",
+                "GET",
+                f"/api/v5/otp/retry?authkey={OTP_AUTH_KEY}&retrytype=1&mobile=91{mobile}",
+            )
+            return res.json()
 
-        res = conn.getresponse()
-        data = res.read()
-        return json.loads(data.decode("utf-8"))
+        result, retry_after = await otp_throttle.run("resend", mobile, resend_otp)
+        if retry_after:
+            return throttled_response(retry_after)
+        return result
     except Exception as exc:
         msg = f"resend otp exception {str(exc)}"
         logger.exception(msg)
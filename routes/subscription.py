@@ -1,13 +1,12 @@
 """Subscription Authorization"""
 
-import requests
 import json
 import logging
 
 from os import environ
 from pydantic import BaseModel
 from sqlmodel import select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
@@ -17,13 +16,15 @@ from fastapi import APIRouter, Depends, BackgroundTasks
 
 
 from dotenv import load_dotenv
+import user_context
+import http_clients
+from circuit_breaker import ProviderUnavailable
 from util import response
 from api_crud import get_single,update_single
 from base_jwt import JWTBearer
 from db import get_db
 from models.user.loan_types import LoanType
 from models.user.bank_info import UserBankInfo
-from models.user.users import Users
 from models.user.loan_applications import LoanApplicationInfo
 from models.user.loans import UserLoanInfo
 from models.user.loan_repayments import LoanRepaymentInfo
@@ -59,11 +60,10 @@ def set_first_charge_date():
 
 
 @router.get("/pre/info")
-async def get_pre_subscription_info(user_id: str, db: Session = Depends(get_db),token_data: BaseModel = Depends(JWTBearer()),):
+async def get_pre_subscription_info(user_id: str, db: AsyncSession = Depends(get_db),token_data: BaseModel = Depends(JWTBearer()),):
     try:
         user_account = await get_single(UserBankInfo, db, user_id, level=True)
-        user_profile = await get_single(Users, db, user_id)
-        user_profile_obj = dict(user_profile.data["result"])
+        user_profile_obj = await user_context.get_user(token_data, user_id, db)
         user_account_obj = dict(user_account.data["result"])
         result = {
             "Name": user_profile_obj["full_name"],
@@ -91,7 +91,7 @@ async def create_subscription_with_plan(
     account_holder_name: str,
     ifsc_code: str,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -110,11 +110,11 @@ async def create_subscription_with_plan(
             .where(LoanApplicationInfo.user_id == user_id)
         )
 
-        loan_type = db.execute(statement).first()
+        loan_type = (await db.execute(statement)).first()
         query = select(
             LoanRepaymentInfo.amount,
         ).where(LoanRepaymentInfo.loan_id == loan_type[2])
-        result = db.execute(query)
+        result = await db.execute(query)
         emi_amount = result.fetchone()
 
         recurringAmount = int(emi_amount[0])
@@ -159,7 +159,9 @@ async def create_subscription_with_plan(
             "X-Client-Id": sub_client_id,
             "X-Client-Secret": sub_client_secret,
         }
-        response_data = requests.post(url, data=json.dumps(payload), headers=headers)
+        response_data = await http_clients.request(
+            "cashfree", "POST", url, content=json.dumps(payload), headers=headers
+        )
         response_obj = json.loads(response_data.text)
         if response_obj["status"] == 200:
             update_input = {
@@ -170,6 +172,8 @@ async def create_subscription_with_plan(
 
         return response(response_obj["message"], 0, 400)
 
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"create subscription plan exception {str(exc)}"
         logger.exception(msg)
@@ -1,7 +1,6 @@
 """User routes"""
 
 import os
-import requests
 import json
 import math
 import mimetypes
@@ -19,12 +18,21 @@ from fastapi import (
     UploadFile,
     BackgroundTasks,
     Form,
+    Query,
+    Request,
 )
 from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dateutil.relativedelta import relativedelta
 from starlette.responses import StreamingResponse
 
+import reference_cache
+import http_clients
+from circuit_breaker import ProviderUnavailable
+from verification_cache import verification_cache, VERIFIED, REJECTED
+import user_context
+import truthscreen_crypto
+from search_index import PrefixIndex
 from base_jwt import JWTBearer
 from bunny_net import upload_file, get_file
 
@@ -34,9 +42,7 @@ from models.user.basic_details import Basic, BasicIn, UserPersonalInfo
 from models.user.company_details import Company, CompanyIn, UserCompanyInfo
 from models.user.business_details import Business, BusinessIn, UserBusinessInfo
 from models.user.school_details import School, SchoolIn, UserSchoolInfo
-from models.user.business_types import BusinessType, BusinessTypeIn
-from models.user.business_natures import BusinessNature
-from models.user.loan_types import LoanType
+from models.user.business_types import BusinessTypeIn
 from models.user.loans import UserLoanInfo
 from models.user.loan_applications import LoanApplicationInfo, LoanApplication
 from models.user.user_references import UserReferenceIfo, UserReferenceIN
@@ -48,11 +54,32 @@ from models.user.users import Users
 from models.user.bank_info import UserBankInfo
 from models.user.login_histories import LoginHistory, LoginHistoryIN
 from models.user.bank_npci import NPCIBank
-from models.user.schools import SchoolName
 from models.user.loan_repayments import LoanRepaymentInfo
 
-from util import response, ALLOWED_IMAGE_TYPES, sort_emi_dates
-from api_crud import get_all, create_new, get_single, update_single, bulk_create_items
+from util import (
+    response,
+    render,
+    content_etag,
+    etag_response,
+    row_validators,
+    is_conditional,
+    is_not_modified,
+    not_modified_response,
+    ALLOWED_IMAGE_TYPES,
+    sort_emi_dates,
+)
+from api_crud import (
+    get_all,
+    create_new,
+    get_single,
+    update_single,
+    bulk_create_items,
+    stream_all,
+    upsert_by_user,
+    create_if_missing,
+    get_modified_at,
+    MAX_PAGE_SIZE,
+)
 from os import environ
 from dotenv import load_dotenv
 
@@ -71,6 +98,14 @@ CASE_FREE_CLIENT_SECRET_PROD = environ.get("CASE_FREE_CLIENT_SECRET_PROD")
 CASE_FREE_SIGNATURE_PROD = environ.get("CASE_FREE_SIGNATURE_PROD")
 tenure = environ.get("TENURE")
 LOAN_NO = environ.get("LOAN_NO")
+SEARCH_LIMIT = int(environ.get("SEARCH_LIMIT", "20"))
+# TruthScreen statuses taken as a definitive PAN rejection and cached, none
+# until the provider confirms which statuses are not transient
+PAN_REJECTED_STATUSES = {
+    int(status)
+    for status in environ.get("PAN_REJECTED_STATUSES", "").split(",")
+    if status.strip()
+}
 
 
 def background_signup_level(
@@ -100,15 +135,66 @@ def kyc_background_signup_level(user_id, background_tasks, db, input_field):
         return response(str(exc), 0, 404)
 
 
-def encrypt_decrypt_api(headers, endpoint, payload):
+async def encrypt_decrypt_api(headers, endpoint, payload):
+
+    return await truthscreen_crypto.envelope(headers, endpoint, payload)
+
+
+def reference_response(message, result):
+    """Response for a list served from the reference cache"""
+    if not result:
+        return response("No data found", 0, 404, result)
+    return response(message, 1, 200, result)
+
 
-    url = "https://www.truthscreen.com/v1/apicall"
-    url = f"{url}/{endpoint}"
-    result = requests.request("POST", url, headers=headers, data=payload)
-    return result.text
+def id_name_map(rows):
+    return {row["id"]: row["name"] for row in rows}
 
 
-async def get_loan_details(user_id: str, db: Session):
+def rows_by_id(rows):
+    return {row["id"]: row for row in rows}
+
+
+def reference_body(message, result):
+    """Rendered reference response and its ETag"""
+    body = render(reference_response(message, result)).body
+    return body, content_etag(body)
+
+
+async def cached_reference(request, cache, key, message, build, db):
+    """Reference list rendered once per cache load and answered with 304
+    when the client already holds it"""
+    try:
+        body, etag = await cache.view(
+            key, lambda rows: reference_body(message, build(rows)), db
+        )
+    except Exception as exc:
+        msg = f"reference {cache.name} exception {str(exc)}"
+        logger.exception(msg)
+        return render(response(str(exc), 0, 400))
+    return etag_response(request, body, etag)
+
+
+async def conditional_single(request, db_model, db, id, level=False):
+    """get_single answered with 304 when the row's modified_at shows the
+    client's copy is current, and with Last-Modified/ETag otherwise"""
+    tag = f"{db_model.__tablename__}-{id}"
+    if is_conditional(request):
+        modified_at = await get_modified_at(db_model, db, id, level)
+        if modified_at is not None:
+            validators = row_validators(tag, modified_at)
+            if is_not_modified(request, validators):
+                return not_modified_response(validators)
+
+    response_obj = await get_single(db_model, db, id, level=level)
+    http_response = render(response_obj)
+    modified_at = getattr(response_obj.data["result"], "modified_at", None)
+    if modified_at is not None:
+        http_response.headers.update(row_validators(tag, modified_at))
+    return http_response
+
+
+async def get_loan_details(user_id: str, db: AsyncSession):
     loan_obj = await get_single(
         LoanApplicationInfo,
         db,
@@ -119,8 +205,13 @@ async def get_loan_details(user_id: str, db: Session):
     loan_type = loan_obj.data["result"].loan_id
     loan_approved = loan_obj.data["result"].loan_approved
 
-    loan_type_info = await get_single(LoanType, db, loan_type)
-    loan_type_info = dict(loan_type_info.data["result"])
+    loan_types = await reference_cache.loan_types.view("by_id", rows_by_id, db)
+    loan_type_info = loan_types.get(loan_type)
+    if loan_type_info is None:
+        # Added since the last load, read the table again once
+        reference_cache.loan_types.invalidate()
+        loan_types = await reference_cache.loan_types.view("by_id", rows_by_id, db)
+        loan_type_info = loan_types[loan_type]
     gateway_fee = loan_type_info["gateway_fee"]
     additional_fee = loan_type_info["additional_fee"]
     processing_fee = loan_type_info["processing_fee"]
@@ -140,21 +231,24 @@ async def basic_user_details(
     full_name: str,
     user: BasicIn,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
         message = "Basic user's details added successfully"
-        basic_info = await create_new(user, UserPersonalInfo, db, message)
+        basic_info = await upsert_by_user(
+            user.user_id, user, UserPersonalInfo, db, message
+        )
         if basic_info.data["result"]:
-            user_id = basic_info.data["result"].user_id
+            user_id = basic_info.data["result"]["user_id"]
             update_input = {"email": email, "full_name": full_name}
+            user_context.mark_updated(user_id)
             background_tasks.add_task(
                 update_single, int(user_id), update_input, Users, db, "message"
             )
             input_field = {
                 "is_basic_completed": True,
-                "provision_status": basic_info.data["result"].profession,
+                "provision_status": basic_info.data["result"].get("profession"),
             }
             background_signup_level(
                 basic_info.data["result"], background_tasks, db, input_field, "create"
@@ -171,7 +265,7 @@ async def basic_user_details(
 async def update_basic_user_details(
     user_id: str,
     update_input: Basic,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     message = "Basic details updated successful"
@@ -185,7 +279,7 @@ async def update_basic_user_details(
 async def user_company_details(
     company_input: CompanyIn,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -207,7 +301,7 @@ async def user_company_details(
 async def update_user_company_details(
     user_id: str,
     update_input: Company,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     message = "Company details updated successful"
@@ -220,7 +314,7 @@ async def update_user_company_details(
 @router.post("/business")
 async def user_business_details(
     business_input: BusinessIn,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -244,7 +338,7 @@ async def user_business_details(
 async def update_user_business_details(
     user_id: str,
     update_input: Business,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     message = "Business details updated successful"
@@ -257,7 +351,7 @@ async def update_user_business_details(
 @router.post("/consent")
 async def user_consent(
     business_input: UserConsentIN,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -269,37 +363,101 @@ async def user_consent(
 
 # @router.post("/signup/level")
 async def create_signup_level(
-    signup_level_input: SignupLevelIn, db: Session = Depends(get_db)
+    signup_level_input: SignupLevelIn, db: AsyncSession = Depends(get_db)
 ):
 
-    response_obj = await create_new(signup_level_input, SignupLevelInfo, db, "message")
+    user_id = dict(signup_level_input)["user_id"]
+    response_obj = await upsert_by_user(
+        user_id, signup_level_input, SignupLevelInfo, db, "message"
+    )
     return response_obj.settings
 
 
 @router.get("/signup/level")
 async def get_signup_level(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
-    return await get_single(SignupLevelInfo, db, user_id, level=True)
+    return await conditional_single(request, SignupLevelInfo, db, user_id, level=True)
 
 
 @router.get("/bank/name")
 async def get_bank_name(
-    db: Session = Depends(get_db),
+    request: Request,
+    q: str = None,
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
-    return await get_all(NPCIBank, db, "Bank list", columns=["bank_name"])
+    columns = ["bank_name"]
+    if q:
+        try:
+            index = await reference_cache.banks.view(
+                "prefix_index", lambda rows: PrefixIndex(rows, "bank_name"), db
+            )
+        except Exception as exc:
+            msg = f"reference banks exception {str(exc)}"
+            logger.exception(msg)
+            return render(response(str(exc), 0, 400))
+        banks = [
+            {"bank_name": row["bank_name"]}
+            for row in index.search(q, min(limit or SEARCH_LIMIT, SEARCH_LIMIT))
+        ]
+        return etag_response(request, *reference_body("Bank list", banks))
+    if stream:
+        return await stream_all(NPCIBank, db, columns)
+    if limit:
+        response_obj = await get_all(
+            NPCIBank, db, "Bank list", columns=columns, cursor=cursor, limit=limit
+        )
+        return render(response_obj)
+
+    return await cached_reference(
+        request,
+        reference_cache.banks,
+        "bank_name",
+        "Bank list",
+        lambda rows: [{"bank_name": row["bank_name"]} for row in rows],
+        db,
+    )
 
 
 @router.get("/school/name")
 async def get_school_name(
-    db: Session = Depends(get_db),
+    request: Request,
+    q: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
-    return await get_all(SchoolName, db, "School list", columns=["name"])
+    if q:
+        # Reading the rows keeps the index fresh, it is refreshed on reload
+        try:
+            await reference_cache.schools.get(db)
+        except Exception as exc:
+            msg = f"reference schools exception {str(exc)}"
+            logger.exception(msg)
+            return render(response(str(exc), 0, 400))
+        schools = [
+            {"name": row["name"]}
+            for row in reference_cache.school_index.search(
+                q, min(limit or SEARCH_LIMIT, SEARCH_LIMIT)
+            )
+        ]
+        return etag_response(request, *reference_body("School list", schools))
+    return await cached_reference(
+        request,
+        reference_cache.schools,
+        "name",
+        "School list",
+        lambda rows: [{"name": row["name"]} for row in rows],
+        db,
+    )
 
 
 @router.put("/profile")
@@ -308,7 +466,7 @@ async def update_profile(
     email: str = None,
     full_name: str = None,
     profile_img: UploadFile = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -326,7 +484,7 @@ async def update_profile(
                 content = await profile_img.read()
                 f.write(content)
 
-            response_obj = upload_file(temp_file_path, new_filename, m="p_image")
+            response_obj = await upload_file(temp_file_path, new_filename, m="p_image")
             if response_obj.status_code == 201:
                 update_input["image"] = new_filename
         if email:
@@ -337,6 +495,7 @@ async def update_profile(
         message = "Profile updated successful"
 
         response_obj = await update_single(user_id, update_input, Users, db, message)
+        user_context.mark_updated(user_id)
         return response_obj.settings
     except Exception as exc:
         msg = f"user loan status exception {str(exc)}"
@@ -347,14 +506,16 @@ async def update_profile(
 @router.get("/profile/image")
 async def get_user_profile(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
         response_obj = await get_single(Users, db, user_id, columns=["image"])
         profile_image_url = getattr(response_obj.data["result"], "image", None)
         if profile_image_url:
-            response_date = get_file(response_obj.data["result"].image, m="p_image")
+            response_date = await get_file(
+                response_obj.data["result"].image, m="p_image"
+            )
             if response_date.status_code == 200:
                 image_stream = BytesIO(response_date.content)
                 return StreamingResponse(image_stream, media_type="image/jpeg")
@@ -371,7 +532,7 @@ async def upload_aadhar_image(
     background_tasks: BackgroundTasks,
     user_id: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -386,7 +547,7 @@ async def upload_aadhar_image(
             content = await file.read()
             f.write(content)
 
-        response_obj = upload_file(temp_file_path, new_filename, m="aadhar_image")
+        response_obj = await upload_file(temp_file_path, new_filename, m="aadhar_image")
         if response_obj.status_code == 201:
             update_input = {"aadhar_image": new_filename}
             await update_single(
@@ -409,7 +570,7 @@ async def upload_aadhar_image(
 @router.get("/aadhar/image", tags=["verification"])
 async def get_user_aadhar(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -419,7 +580,7 @@ async def get_user_aadhar(
 
     aadhar_image_url = getattr(response_obj.data["result"], "aadhar_image", None)
     if aadhar_image_url:
-        response_date = get_file(aadhar_image_url, m="aadhar_image")
+        response_date = await get_file(aadhar_image_url, m="aadhar_image")
 
         if response_date.status_code == 200:
             image_stream = BytesIO(response_date.content)
@@ -431,7 +592,7 @@ async def get_user_aadhar(
 @router.get("/pan/image", tags=["verification"])
 async def get_user_pan(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -441,7 +602,7 @@ async def get_user_pan(
 
         pan_image_url = getattr(response_obj.data["result"], "pan_image", None)
         if pan_image_url:
-            response_date = get_file(pan_image_url, m="pan_image")
+            response_date = await get_file(pan_image_url, m="pan_image")
 
             if response_date.status_code == 200:
                 image_stream = BytesIO(response_date.content)
@@ -456,18 +617,19 @@ async def get_user_pan(
 
 @router.get("/profile")
 async def get_user_profile(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
-    return await get_single(Users, db, user_id)
+    return await conditional_single(request, Users, db, user_id)
 
 
 @router.post("/contact")
 async def upload_contact(
     user_id: str,
     contact_json: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -483,7 +645,9 @@ async def upload_contact(
         )
         message = "User contacts added successfully"
 
-        response_obj = await create_new(contact_input, UserContactIfo, db, message)
+        response_obj = await upsert_by_user(
+            user_id, contact_input, UserContactIfo, db, message
+        )
         return response_obj.settings
     except Exception as exc:
         msg = f"upload contact exception {str(exc)}"
@@ -493,99 +657,157 @@ async def upload_contact(
 
 @router.get("/basic")
 async def get_user_basic_info(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
+    # The response merges user_details and users, so it changes with either
+    tag = f"user_details-{user_id}"
+    user_modified_at = None
+    if is_conditional(request):
+        basic_modified_at = await get_modified_at(
+            UserPersonalInfo, db, user_id, level=True
+        )
+        user_modified_at = await get_modified_at(Users, db, user_id)
+        if basic_modified_at and user_modified_at:
+            validators = row_validators(
+                tag, max(basic_modified_at, user_modified_at)
+            )
+            if is_not_modified(request, validators):
+                return not_modified_response(validators)
 
     response_obj = await get_single(UserPersonalInfo, db, user_id, level=True)
     if response_obj.data["result"]:
-        profile_response = await get_single(
-            Users, db, user_id, columns=["email", "full_name"]
+        # From the token claims when they are current, without reading users
+        # unless the conditional probe above already did
+        user = await user_context.get_user(
+            token_data, user_id, db, modified_at=user_modified_at
         )
-        user_response = dict(profile_response.data["result"])
-        user_response.pop("id", None)
+        if user is None:
+            return response("Data not found", 0, 400)
 
-        result = {**dict(response_obj.data["result"]), **user_response}
+        result = {
+            **dict(response_obj.data["result"]),
+            "email": user["email"],
+            "full_name": user["full_name"],
+        }
         response_obj.data["result"] = result
-        return response_obj
+        http_response = render(response_obj)
+        # Without the users probe the validators cover user_details only;
+        # revalidation compares against both rows, so they never match stale
+        modified_at = result.get("modified_at")
+        if modified_at:
+            if user_modified_at:
+                modified_at = max(modified_at, user_modified_at)
+            http_response.headers.update(row_validators(tag, modified_at))
+        return http_response
     return response("Data not found", 0, 400)
 
 
 @router.get("/company")
 async def get_user_company_info(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
-    return await get_single(UserCompanyInfo, db, user_id, level=True)
+    return await conditional_single(request, UserCompanyInfo, db, user_id, level=True)
 
 
 @router.get("/business")
 async def get_user_business_info(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
-    return await get_single(UserBusinessInfo, db, user_id, level=True)
+    return await conditional_single(
+        request, UserBusinessInfo, db, user_id, level=True
+    )
 
 
 @router.get("/reference")
 async def get_user_reference_info(
     user_id: str,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     filters = {"user_id": user_id}
-    return await get_all(UserReferenceIfo, db, user_id, filters=filters)
+    if stream:
+        return await stream_all(UserReferenceIfo, db, filters=filters)
+    response_obj = await get_all(
+        UserReferenceIfo, db, user_id, filters=filters, cursor=cursor, limit=limit
+    )
+    return render(response_obj)
 
 
 @router.get("/tickets")
 async def get_user_ticket_info(
     user_id: str,
     status: ticket_Status,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     filters = {"user_id": user_id, "status": status}
-    return await get_all(TicketIfo, db, user_id, filters=filters)
+    if stream:
+        return await stream_all(
+            TicketIfo, db, filters=filters, order_by="created_at", descending=True
+        )
+    response_obj = await get_all(
+        TicketIfo,
+        db,
+        user_id,
+        filters=filters,
+        cursor=cursor,
+        limit=limit,
+        order_by="created_at",
+        descending=True,
+    )
+    return render(response_obj)
 
 
 @router.get("/school")
 async def get_user_school_info(
+    request: Request,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
-    return await get_single(UserSchoolInfo, db, user_id, level=True)
+    return await conditional_single(request, UserSchoolInfo, db, user_id, level=True)
 
 
 # @router.put("/signup/level")
 async def update_signup_level(
-    user_id: str, signup_level_input: SignupLevelIn, db: Session = Depends(get_db)
+    user_id: str, signup_level_input: SignupLevelIn, db: AsyncSession = Depends(get_db)
 ):
-    response_obj = await update_single(
-        user_id, signup_level_input, SignupLevelInfo, db, "message", level=True
+    response_obj = await upsert_by_user(
+        user_id, signup_level_input, SignupLevelInfo, db, "message"
     )
     return response_obj.settings
 
 
 @router.get("/registration/type")
 async def registration_type(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
-        columns = ["name", "id"]
         message = "Loan type retried successfully"
 
-        response_obj = await get_all(BusinessType, db, message, columns)
-        result = {item["id"]: item["name"] for item in response_obj.data["result"]}
-        response_obj.data["result"] = result
-        return response_obj
+        return await cached_reference(
+            request, reference_cache.business_types, "by_id", message, id_name_map, db
+        )
     except Exception as exc:
         msg = f"get registration type exception {str(exc)}"
         logger.exception(msg)
@@ -594,17 +816,16 @@ async def registration_type(
 
 @router.get("/business/nature")
 async def business_nature(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
-        columns = ["name", "id"]
         message = "Loan type retried successfully"
 
-        response_obj = await get_all(BusinessNature, db, message, columns)
-        result = {item["id"]: item["name"] for item in response_obj.data["result"]}
-        response_obj.data["result"] = result
-        return response_obj
+        return await cached_reference(
+            request, reference_cache.business_natures, "by_id", message, id_name_map, db
+        )
     except Exception as exc:
         msg = f"kyc_background_signup_level exception {str(exc)}"
         logger.exception(msg)
@@ -613,22 +834,26 @@ async def business_nature(
 
 @router.get("/loan/type")
 async def loan_type(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     message = "Loan type retried successfully"
-    return await get_all(LoanType, db, message)
+    return await cached_reference(
+        request, reference_cache.loan_types, "rows", message, list, db
+    )
 
 
 @router.get("/loan/status")
 async def user_loan_status(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
-    return await get_single(
+    response_obj = await get_single(
         UserLoanInfo, db, user_id, level=True, columns=["loan_status"]
     )
+    return render(response_obj)
 
 
 @router.post("/select/loan/type")
@@ -636,40 +861,25 @@ async def select_loan_type(
     loan_id: int,
     user_id: int,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
-        print(user_id, loan_id)
-        loan_input = {"user_id": user_id, "loan_id": loan_id}
-        print(loan_input)
-        response_obj = await get_single(LoanApplicationInfo, db, user_id, level=True)
-        print(response_obj)
-        if response_obj.data["result"]:
-            message = "Loan type updated successfully"
-            response_obj = await update_single(
-                response_obj.data["result"].user_id,
-                loan_input,
-                LoanApplicationInfo,
-                db,
-                message,
-                level=True,
-            )
-
-        else:
-            message = "Loan type added successfully"
+        loan_input = {"loan_id": loan_id}
+        message = "Loan type saved successfully"
+        response_obj = await upsert_by_user(
+            user_id, loan_input, LoanApplicationInfo, db, message
+        )
 
-            response_obj = await create_new(
-                loan_input, LoanApplicationInfo, db, message
+        if response_obj.settings["success"]:
+            # Guarded insert, a no-op when the user's loan row already exists
+            input_user_loan = {
+                "loan_application_id": response_obj.data["result"]["id"],
+                "user_id": user_id,
+            }
+            background_tasks.add_task(
+                create_if_missing, input_user_loan, UserLoanInfo, db, "message"
             )
-            if response_obj.data["result"]:
-                input_user_loan = {
-                    "loan_application_id": response_obj.data["result"].id,
-                    "user_id": user_id,
-                }
-                background_tasks.add_task(
-                    create_new, input_user_loan, UserLoanInfo, db, "message"
-                )
         return response_obj.settings
     except Exception as exc:
         msg = f"select loan type exception {str(exc)}"
@@ -680,7 +890,7 @@ async def select_loan_type(
 @router.post("/school")
 async def user_school_details(
     user: SchoolIn,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -700,7 +910,7 @@ async def user_school_details(
 async def update_user_school_details(
     user_id: str,
     update_input: School,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     message = "School details updated successful"
@@ -713,7 +923,7 @@ async def update_user_school_details(
 @router.post("/reference")
 async def user_reference(
     reference_input: UserReferenceIN,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -726,7 +936,7 @@ async def user_reference(
 @router.post("/ticket")
 async def raise_ticket(
     ticket_input: TicketIN,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -739,7 +949,7 @@ async def raise_ticket(
 @router.post("/login/history")
 async def user_login_history(
     login_history: LoginHistoryIN,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -752,7 +962,10 @@ async def user_login_history(
 @router.get("/transaction/history")
 async def user_transaction_history(
     user_id: str,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -760,10 +973,17 @@ async def user_transaction_history(
             UserLoanInfo, db, user_id, level=True, columns=["id"]
         )
         filters = {"is_paid": 1, "loan_id": loan_response.data["result"].id}
+        if stream:
+            return await stream_all(LoanRepaymentInfo, db, filters=filters)
         response_obj = await get_all(
-            LoanRepaymentInfo, db, "Transaction histories", filters=filters
+            LoanRepaymentInfo,
+            db,
+            "Transaction histories",
+            filters=filters,
+            cursor=cursor,
+            limit=limit,
         )
-        return response_obj
+        return render(response_obj)
 
     except Exception as exc:
         msg = f"user emi breakup exception {str(exc)}"
@@ -774,7 +994,7 @@ async def user_transaction_history(
 @router.get("/emi/breakup")
 async def get_emi_breakup(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -789,7 +1009,7 @@ async def get_emi_breakup(
 
         if emi_response.data["result"]:
 
-            return emi_response
+            return render(emi_response)
         else:
             message = "User loan not found"
             return response(message, 0, 404)
@@ -803,7 +1023,7 @@ async def get_emi_breakup(
 @router.get("/loan/overview")
 async def get_loan_overview(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -821,7 +1041,7 @@ async def get_loan_overview(
             LoanRepaymentInfo.date,
             LoanRepaymentInfo.amount,
         ).where(LoanRepaymentInfo.loan_id == loans_info.data["result"].id)
-        result = db.execute(query)
+        result = await db.execute(query)
         results = result.fetchone()
 
         message = "No loan information found"
@@ -853,7 +1073,7 @@ async def get_loan_overview(
 @router.get("/loan/application/info")
 async def get_loan_application_info(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     loan_details = await get_loan_details(user_id, db)
@@ -867,7 +1087,7 @@ async def user_loan_application(
     loan_amount: int,
     user_id: str,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -921,10 +1141,10 @@ async def user_loan_application(
         )
         lon_info_id = dict(user_loan_info_id)["data"]["result"].id
 
-        max_loan_no = (
-            db.query(func.max(UserLoanInfo.loan_no))
-            .filter(UserLoanInfo.loan_no.like(f"{LOAN_NO[:4]}%"))
-            .scalar()
+        max_loan_no = await db.scalar(
+            select(func.max(UserLoanInfo.loan_no)).where(
+                UserLoanInfo.loan_no.like(f"{LOAN_NO[:4]}%")
+            )
         )
         if max_loan_no:
             loan_no = max_loan_no
@@ -942,12 +1162,11 @@ async def user_loan_application(
             level=True,
         )
 
-        input_model = {
-            "loan_id": lon_info_id,
-            "amount": monthly_emi,
-            "date": emi_dates_list,
-        }
-        background_tasks.add_task(bulk_create_items, input_model, LoanRepaymentInfo, db)
+        emi_items = [
+            {"loan_id": lon_info_id, "amount": monthly_emi, "date": emi_date}
+            for emi_date in emi_dates_list
+        ]
+        background_tasks.add_task(bulk_create_items, LoanRepaymentInfo, emi_items, db)
 
         message = "EMI calculated successfully"
         data = {
@@ -973,7 +1192,7 @@ async def user_loan_application(
 @router.get("/bank/statement", tags=["verification"])
 async def get_bank_statement(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -983,7 +1202,7 @@ async def get_bank_statement(
 
         pdf_response_url = getattr(pdf_response.data["result"], "statement", None)
         if pdf_response_url:
-            response_date = get_file(pdf_response_url, m="bank_st")
+            response_date = await get_file(pdf_response_url, m="bank_st")
 
             if response_date.status_code == 200:
                 image_stream = BytesIO(response_date.content)
@@ -1001,7 +1220,7 @@ async def upload_bank_statement(
     background_tasks: BackgroundTasks,
     user_id: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1016,7 +1235,7 @@ async def upload_bank_statement(
             content = await file.read()
             f.write(content)
 
-        response_obj = upload_file(temp_file_path, new_filename, m="bank_st")
+        response_obj = await upload_file(temp_file_path, new_filename, m="bank_st")
         if response_obj.status_code == 201:
 
             update_input = {"statement": new_filename}
@@ -1038,42 +1257,48 @@ async def upload_bank_statement(
 
 
 @router.get("/upcoming/emi")
-def get_upcoming_and_bounced_emi(
+async def get_upcoming_and_bounced_emi(
     user_id: int,
-    session: Session = Depends(get_db),
+    session: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
-        loan_application = session.execute(
-            select(UserLoanInfo.id).where(UserLoanInfo.user_id == user_id)
+        loan_application = (
+            await session.execute(
+                select(UserLoanInfo.id).where(UserLoanInfo.user_id == user_id)
+            )
         ).first()
         if not loan_application:
             raise HTTPException(status_code=404, detail="Loan application not found")
 
         # Get the upcoming EMI
-        upcoming_repayment = session.execute(
-            select(LoanRepaymentInfo.date, LoanRepaymentInfo.amount)
-            .where(
-                LoanRepaymentInfo.loan_id == loan_application.id,
-                LoanRepaymentInfo.status == "pending",
-                LoanRepaymentInfo.is_paid == False,
-                LoanRepaymentInfo.date > date.today(),
+        upcoming_repayment = (
+            await session.execute(
+                select(LoanRepaymentInfo.date, LoanRepaymentInfo.amount)
+                .where(
+                    LoanRepaymentInfo.loan_id == loan_application.id,
+                    LoanRepaymentInfo.status == "pending",
+                    LoanRepaymentInfo.is_paid == False,
+                    LoanRepaymentInfo.date > date.today(),
+                )
+                .order_by(LoanRepaymentInfo.date)
             )
-            .order_by(LoanRepaymentInfo.date)
         ).first()
         last_40_days_start = upcoming_repayment.date - timedelta(days=40)
 
-        bounced_emis = session.execute(
-            select(LoanRepaymentInfo.date, LoanRepaymentInfo.amount)
-            .where(
-                LoanRepaymentInfo.loan_id == loan_application.id,
-                LoanRepaymentInfo.status == "pending",
-                LoanRepaymentInfo.is_paid == False,
-                LoanRepaymentInfo.date.between(
-                    last_40_days_start, upcoming_repayment.date
-                ),
+        bounced_emis = (
+            await session.execute(
+                select(LoanRepaymentInfo.date, LoanRepaymentInfo.amount)
+                .where(
+                    LoanRepaymentInfo.loan_id == loan_application.id,
+                    LoanRepaymentInfo.status == "pending",
+                    LoanRepaymentInfo.is_paid == False,
+                    LoanRepaymentInfo.date.between(
+                        last_40_days_start, upcoming_repayment.date
+                    ),
+                )
+                .order_by(LoanRepaymentInfo.date)
             )
-            .order_by(LoanRepaymentInfo.date)
         ).first()
         emi = {
             "upcoming": {
@@ -1101,7 +1326,7 @@ async def verify_Bank(
     account_number: str,
     ifsc_code: str,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1117,9 +1342,29 @@ async def verify_Bank(
             "X-Cf-Signature": CASE_FREE_SIGNATURE_PROD,
         }
 
-        bank_response = requests.post(url, json=payload, headers=headers)
-        bank_obj = json.loads(bank_response.text)
-        if bank_response.status_code == 200:
+
+        async def fetch():
+            bank_response = await http_clients.request(
+                "cashfree", "POST", url, json=payload, headers=headers
+            )
+            return bank_response.status_code, json.loads(bank_response.text)
+
+        def outcome(result):
+            status_code, bank_obj = result
+            if status_code != 200:
+                return None
+            if bank_obj["account_status"] == "VALID":
+                return VERIFIED
+            return REJECTED if bank_obj["account_status"] == "INVALID" else None
+
+        # Repeats reuse the result, the user's records are still updated
+        status_code, bank_obj = await verification_cache.lookup(
+            "bank",
+            f"{account_number.strip()}:{ifsc_code.strip().upper()}",
+            fetch,
+            outcome,
+        )
+        if status_code == 200:
             if bank_obj["account_status"] == "VALID":
                 bank_input = {
                     "bank_name": bank_obj["bank_name"],
@@ -1138,10 +1383,10 @@ async def verify_Bank(
                 return response_obj.settings
             return response(bank_obj["account_status_code"], 0, 400)
 
-        return response(
-            f'{bank_obj["code"]} {bank_obj["message"]}', 0, bank_response.status_code
-        )
+        return response(f'{bank_obj["code"]} {bank_obj["message"]}', 0, status_code)
 
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"verify bank exception {str(exc)}"
         logger.exception(msg)
@@ -1151,7 +1396,7 @@ async def verify_Bank(
 @router.get("/bank/statement", tags=["verification"])
 async def get_bank_statement(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     # Fetch the pdf record
@@ -1179,7 +1424,7 @@ async def upload_pan_image(
     background_tasks: BackgroundTasks,
     user_id: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1194,7 +1439,7 @@ async def upload_pan_image(
             content = await file.read()
             f.write(content)
 
-        response_obj = upload_file(temp_file_path, new_filename, m="pan_image")
+        response_obj = await upload_file(temp_file_path, new_filename, m="pan_image")
         if response_obj.status_code == 201:
 
             update_input = {"pan_image": new_filename}
@@ -1218,7 +1463,7 @@ async def upload_pan_image(
 @router.get("/kyc/details", tags=["verification"])
 async def get_kyc_details(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1254,7 +1499,7 @@ async def verify_pan_number(
     background_tasks: BackgroundTasks,
     pan_number: str,
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
 
@@ -1267,14 +1512,27 @@ async def verify_pan_number(
             {"PanNumber": pan_number, "docType": 523, "transId": "Alpha-123"}
         )
 
-        encrypt_payload = encrypt_decrypt_api(headers, "encrypt", payload)
-        payload = json.dumps({"requestData": encrypt_payload})
+        async def fetch():
+            encrypt_payload = await encrypt_decrypt_api(headers, "encrypt", payload)
+            request_data = json.dumps({"requestData": encrypt_payload})
+            result = await http_clients.request(
+                "truthscreen", "POST", url, content=request_data, headers=headers
+            )
+            decrypt_response = await encrypt_decrypt_api(
+                headers, "decrypt", result.text
+            )
+            return json.loads(decrypt_response)
 
-        message = "PAN verification successful"
-        result = requests.post(url, data=payload, headers=headers)
-        decrypt_response = encrypt_decrypt_api(headers, "decrypt", result.text)
+        def outcome(result):
+            if result["status"] == 1:
+                return VERIFIED
+            return REJECTED if result["status"] in PAN_REJECTED_STATUSES else None
 
-        decrypt_response = json.loads(decrypt_response)
+        message = "PAN verification successful"
+        # Repeats reuse the result, the user's records are still updated
+        decrypt_response = await verification_cache.lookup(
+            "pan", pan_number.strip().upper(), fetch, outcome
+        )
         if decrypt_response["status"] == 1:
             # return json.loads(decrypt_response)
 
@@ -1292,6 +1550,8 @@ async def verify_pan_number(
             decrypt_response["msg"], 0, decrypt_response["status"], decrypt_response
         )
 
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"pan verify exception {str(exc)}"
         logger.exception(msg)
@@ -1313,11 +1573,13 @@ async def verify_aadhaar_number(
             {"aadharNo": aadhaar_number, "docType": 211, "transId": "beta-12321"}
         )
 
-        encrypt_payload = encrypt_decrypt_api(headers, "encrypt", payload)
+        encrypt_payload = await encrypt_decrypt_api(headers, "encrypt", payload)
         payload = json.dumps({"requestData": encrypt_payload})
 
-        result = requests.post(url, data=payload, headers=headers)
-        decrypt_response = encrypt_decrypt_api(headers, "decrypt", result.text)
+        result = await http_clients.request(
+            "truthscreen", "POST", url, content=payload, headers=headers
+        )
+        decrypt_response = await encrypt_decrypt_api(headers, "decrypt", result.text)
         message = "Otp send to linked mobile number"
         decrypt_response = json.loads(decrypt_response)
 
@@ -1326,6 +1588,8 @@ async def verify_aadhaar_number(
         return response(
             decrypt_response["msg"], 0, decrypt_response["status"], decrypt_response
         )
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"send aadhar otp exception {str(exc)}"
         logger.exception(msg)
@@ -1339,7 +1603,7 @@ async def verify_aadhaar_otp(
     user_id: str,
     aadhaar_number: str,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1353,11 +1617,13 @@ async def verify_aadhaar_otp(
                 "otp": otp,
             }
         )
-        encrypt_payload = encrypt_decrypt_api(headers, "encrypt", payload)
+        encrypt_payload = await encrypt_decrypt_api(headers, "encrypt", payload)
         payload = json.dumps({"requestData": encrypt_payload})
 
-        result = requests.post(url, data=payload, headers=headers)
-        decrypt_response = encrypt_decrypt_api(headers, "decrypt", result.text)
+        result = await http_clients.request(
+            "truthscreen", "POST", url, content=payload, headers=headers
+        )
+        decrypt_response = await encrypt_decrypt_api(headers, "decrypt", result.text)
         decrypt_response = json.loads(decrypt_response)
         if decrypt_response["status"] == 1:
 
@@ -1377,6 +1643,8 @@ async def verify_aadhaar_otp(
         return response(
             decrypt_response["msg"], 0, decrypt_response["status"], decrypt_response
         )
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"verify aadhar otp exception {str(exc)}"
         logger.exception(msg)
@@ -1409,15 +1677,17 @@ async def verify_liveness(
             "username": username,
             "Content-Type": f"multipart/form-data; boundary={boundary}",
         }
-        file = []
-        result = requests.post(
+        result = await http_clients.request(
+            "truthscreen",
+            "POST",
             liveness_token_url,
             headers=headers_liveness,
-            data=payload.encode("utf-8"),
-            files=file,
+            content=payload.encode("utf-8"),
         )
         headers_encrypt = {"username": username, "content-type": "application/json"}
-        decrypt_response = encrypt_decrypt_api(headers_encrypt, "decrypt", result.text)
+        decrypt_response = await encrypt_decrypt_api(
+            headers_encrypt, "decrypt", result.text
+        )
 
         decrypt_response = json.loads(decrypt_response)
         if decrypt_response["status"] != 1:
@@ -1463,17 +1733,25 @@ async def verify_liveness(
             f"--{boundary}--\r\n"
         )
 
-        result = requests.post(
-            url, headers=headers_liveness, data=payload.encode("latin-1")
+        result = await http_clients.request(
+            "truthscreen",
+            "POST",
+            url,
+            headers=headers_liveness,
+            content=payload.encode("latin-1"),
         )
 
-        decrypt_response = encrypt_decrypt_api(headers_encrypt, "decrypt", result.text)
+        decrypt_response = await encrypt_decrypt_api(
+            headers_encrypt, "decrypt", result.text
+        )
 
         decrypt_response = json.loads(decrypt_response)
         if decrypt_response["result"] != "Real":
             return response(decrypt_response["result"], 0, 400, decrypt_response)
 
         return response(decrypt_response["result"], 1, 200, decrypt_response)
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"liveness verification exception {str(exc)}"
         logger.exception(msg)
@@ -1483,14 +1761,14 @@ async def verify_liveness(
 @router.post("/credit", tags=["verification"])
 async def credit_otp(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
         basic_info = await get_single(UserPersonalInfo, db, user_id, level=True)
-        user_info = await get_single(Users, db, user_id)
+        # Sent to the credit bureau, so checked against users.modified_at
+        user_details = await user_context.get_user(token_data, user_id, db, fresh=True)
         basic_details = dict(basic_info.data["result"])
-        user_details = dict(user_info.data["result"])
         headers = {"username": username, "content-type": "application/json"}
 
         full_name = user_details["full_name"].split(" ")
@@ -1512,7 +1790,7 @@ async def credit_otp(
             }
         )
 
-        encrypt_payload = encrypt_decrypt_api(
+        encrypt_payload = await encrypt_decrypt_api(
             headers, "encrypt", otp_generation_payload
         )
         otp_generation_url = (
@@ -1520,9 +1798,15 @@ async def credit_otp(
         )
         payload = json.dumps({"requestData": encrypt_payload})
 
-        response_obj = requests.post(otp_generation_url, data=payload, headers=headers)
-        decrypt_payload = encrypt_decrypt_api(headers, "decrypt", response_obj.text)
+        response_obj = await http_clients.request(
+            "truthscreen", "POST", otp_generation_url, content=payload, headers=headers
+        )
+        decrypt_payload = await encrypt_decrypt_api(
+            headers, "decrypt", response_obj.text
+        )
         return json.loads(decrypt_payload)
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"create otp for credit report exception {str(exc)}"
         logger.exception(msg)
@@ -1535,7 +1819,7 @@ async def credit_otp_verification(
     otp: str,
     tsTransID: str,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token_data: BaseModel = Depends(JWTBearer()),
 ):
     try:
@@ -1556,11 +1840,13 @@ async def credit_otp_verification(
             }
         )
 
-        encrypt_payload = encrypt_decrypt_api(headers, "encrypt", otp_payload)
+        encrypt_payload = await encrypt_decrypt_api(headers, "encrypt", otp_payload)
         payload = json.dumps({"requestData": encrypt_payload})
 
-        result = requests.post(verify_otp_url, data=payload, headers=headers)
-        decrypt_response = encrypt_decrypt_api(headers, "decrypt", result.text)
+        result = await http_clients.request(
+            "truthscreen", "POST", verify_otp_url, content=payload, headers=headers
+        )
+        decrypt_response = await encrypt_decrypt_api(headers, "decrypt", result.text)
 
         decrypt_response = json.loads(decrypt_response)
         if decrypt_response["status"] == 1:
@@ -1579,6 +1865,8 @@ async def credit_otp_verification(
             )
         return response("No Record Found!.", 0, decrypt_response["status"])
 
+    except ProviderUnavailable as exc:
+        return response(str(exc), 0, 503)
     except Exception as exc:
         msg = f"verify credit otp exception {str(exc)}"
         logger.exception(msg)
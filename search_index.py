@@ -0,0 +1,144 @@
+"""In-memory search indexes for reference data"""
+
+import re
+from bisect import bisect_left
+
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def tokenize(text) -> list:
+    """Lowercase alphanumeric words of text"""
+    return _NON_WORD.sub(" ", (text or "").lower()).split()
+
+
+class PrefixIndex:
+    """Sorted word index answering typeahead queries.
+
+    Every word of every row is kept in one sorted list, so the rows with a
+    word starting with a prefix are a contiguous bisect range. A row matches
+    when each query word is a prefix of one of its words.
+    """
+
+    def __init__(self, rows, key):
+        self.rows = rows
+        self.key = key
+        self.row_words = [tokenize(row[key]) for row in rows]
+        entries = sorted(
+            (word, position)
+            for position, words in enumerate(self.row_words)
+            for word in set(words)
+        )
+        self.words = [word for word, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def _prefix_positions(self, prefix) -> set:
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + "\uffff", start)
+        return set(self.positions[start:end])
+
+    def search(self, query, limit=20) -> list:
+        """Rows matching every query word, names starting with the query first"""
+        query_words = tokenize(query)
+        if not query_words:
+            return []
+
+        # Narrow on the longest word, it has the smallest bisect range
+        longest = max(query_words, key=len)
+        candidates = [
+            position
+            for position in self._prefix_positions(longest)
+            if all(
+                any(word.startswith(query_word) for word in self.row_words[position])
+                for query_word in query_words
+            )
+        ]
+
+        phrase = " ".join(query_words)
+        candidates.sort(
+            key=lambda position: (
+                not " ".join(self.row_words[position]).startswith(phrase),
+                self.row_words[position],
+            )
+        )
+        return [self.rows[position] for position in candidates[:limit]]
+
+
+def trigrams(text) -> set:
+    """Padded character trigrams of each word, as in pg_trgm"""
+    grams = set()
+    for word in tokenize(text):
+        padded = f"  {word} "
+        grams.update(padded[index : index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Trigram inverted index for typo tolerant, ranked name search.
+
+    Rows are scored by the share of the query trigrams they contain, ties
+    broken by Jaccard similarity so closer, shorter names rank higher.
+    refresh() applies only the rows that were added, removed or renamed.
+    """
+
+    def __init__(self, key, min_score=0.5):
+        self.key = key
+        self.min_score = min_score
+        self.rows = {}
+        self.row_grams = {}
+        self.postings = {}
+
+    def add(self, row):
+        row_id = row["id"]
+        if row_id in self.rows:
+            self.remove(row_id)
+        grams = trigrams(row[self.key])
+        self.rows[row_id] = row
+        self.row_grams[row_id] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(row_id)
+
+    def remove(self, row_id):
+        self.rows.pop(row_id, None)
+        for gram in self.row_grams.pop(row_id, ()):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(row_id)
+                if not posting:
+                    del self.postings[gram]
+
+    def refresh(self, rows):
+        """Bring the index in line with rows, touching only what changed"""
+        seen = set()
+        for row in rows:
+            seen.add(row["id"])
+            current = self.rows.get(row["id"])
+            if current is None or current[self.key] != row[self.key]:
+                self.add(row)
+            else:
+                self.rows[row["id"]] = row
+        for row_id in set(self.rows) - seen:
+            self.remove(row_id)
+
+    def search(self, query, limit=20) -> list:
+        """Best matching rows for query, highest score first"""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        shared = {}
+        for gram in query_grams:
+            for row_id in self.postings.get(gram, ()):
+                shared[row_id] = shared.get(row_id, 0) + 1
+
+        scored = []
+        for row_id, count in shared.items():
+            coverage = count / len(query_grams)
+            if coverage < self.min_score:
+                continue
+            union = len(query_grams) + len(self.row_grams[row_id]) - count
+            similarity = count / union
+            scored.append((-coverage, -similarity, row_id))
+
+        scored.sort()
+        return [self.rows[row_id] for _, _, row_id in scored[:limit]]
@@ -0,0 +1,97 @@
+"""Test setup: the app against an in-memory SQLite DB"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Settings read at import time, the MySQL engines are created but never used
+TEST_ENV = {
+    "DB_USERNAME": "test",
+    "DB_PASSWORD": "test",
+    "DB_PORT": "3306",
+    "DB_NAME": "test",
+    "SECRET_HS512_KEY": "test",
+    "SIGNING_KEY": "HS512",
+}
+for key, value in TEST_ENV.items():
+    os.environ.setdefault(key, value)
+
+
+@pytest.fixture
+def sessionmaker():
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import SQLModel
+
+    import main  # noqa: F401, registers every model on SQLModel.metadata
+    import query_stats
+
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    query_stats.instrument(engine)
+
+    async def create_tables():
+        async with engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(create_tables())
+    # Same session options as db.AsyncSessionLocal
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def client(sessionmaker):
+    """TestClient with the IP whitelist off and get_db on the test DB"""
+    from fastapi.testclient import TestClient
+
+    import db
+    import main
+
+    async def get_test_db():
+        async with sessionmaker() as session:
+            yield session
+
+    middleware = main.app.user_middleware
+    main.app.user_middleware = [
+        item
+        for item in middleware
+        if getattr(item.kwargs.get("dispatch"), "__name__", "") != "ip_whitelist"
+    ]
+    main.app.middleware_stack = None
+    main.app.dependency_overrides[db.get_db] = get_test_db
+    # Not entered as a context manager: startup would load the reference
+    # and revocation data from MySQL
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+    main.app.user_middleware = middleware
+    main.app.middleware_stack = None
+
+
+def auth_headers(user_id, full_name="Test User", mobile="9999999999", email="a@b.in"):
+    """Bearer header with a token issued to the user"""
+    from base_jwt import create_service_token
+
+    jwt_token = create_service_token(full_name, mobile, user_id, email)
+    return {"Authorization": f"Bearer {jwt_token}"}
+
+
+def add_rows(sessionmaker, *rows):
+    async def add():
+        async with sessionmaker() as session:
+            session.add_all(rows)
+            await session.commit()
+
+    run(add())
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
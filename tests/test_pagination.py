@@ -0,0 +1,34 @@
+"""Keyset pagination limits"""
+
+import pytest
+
+from conftest import add_rows, auth_headers, run
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_route_rejects_limit_below_one(client, limit):
+    result = client.get(
+        f"/user/reference?user_id=1&limit={limit}", headers=auth_headers(1)
+    )
+
+    assert result.status_code == 422
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_get_all_clamps_limit_to_one(sessionmaker, limit):
+    from api_crud import get_all
+    from models.user.bank_npci import NPCIBank
+
+    add_rows(sessionmaker, NPCIBank(bank_name="A"), NPCIBank(bank_name="B"))
+
+    async def first_page():
+        async with sessionmaker() as session:
+            return await get_all(
+                NPCIBank, session, "Bank list", columns=["bank_name"], limit=limit
+            )
+
+    response_obj = run(first_page())
+
+    assert response_obj.settings["status"] == 200
+    assert response_obj.data["result"] == [{"bank_name": "A"}]
+    assert response_obj.data["next_cursor"]
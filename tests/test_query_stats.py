@@ -0,0 +1,38 @@
+"""Slow query and query budget logging"""
+
+import os
+import sys
+import subprocess
+import textwrap
+
+from conftest import ROOT, TEST_ENV
+
+
+def test_warnings_reach_app_log_under_main_config(tmp_path):
+    # main.py configures the root logger for errors only, into app.log in
+    # the working directory; run it in a fresh process so basicConfig applies
+    script = textwrap.dedent(
+        """
+        import logging
+        from sqlalchemy import create_engine, text
+
+        import main
+        import query_stats
+
+        engine = create_engine("sqlite://")
+        query_stats.instrument(engine)
+        with query_stats.track("/test", budget=1, strict=False):
+            with engine.connect() as connection:
+                connection.execute(text("select 1"))
+                connection.execute(text("select 2"))
+        logging.shutdown()
+        """
+    )
+    env = {**os.environ, **TEST_ENV, "DB_SLOW_QUERY_MS": "0", "PYTHONPATH": ROOT}
+    subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env=env, check=True
+    )
+
+    log = (tmp_path / "app.log").read_text()
+    assert "query_stats - WARNING - slow query" in log
+    assert "/test ran 2 queries, budget is 1" in log
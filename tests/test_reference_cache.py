@@ -0,0 +1,68 @@
+"""Reference data cache"""
+
+from conftest import add_rows, auth_headers, run
+
+
+def test_invalidation_reaches_other_workers(sessionmaker):
+    import reference_cache
+    from models.user.reference_versions import ReferenceVersion
+    from sqlalchemy import update
+
+    banks = reference_cache.banks
+    add_rows(sessionmaker, ReferenceVersion(name="banks", version=0))
+
+    async def invalidate_on_another_worker():
+        async with sessionmaker() as session:
+            await banks.load(session)
+            await reference_cache.poll_versions(session)
+            assert banks.is_fresh()
+
+            # What broadcast_invalidate on another worker writes
+            await session.execute(
+                update(ReferenceVersion)
+                .where(ReferenceVersion.name == "banks")
+                .values(version=ReferenceVersion.version + 1)
+            )
+            await session.commit()
+            await reference_cache.poll_versions(session)
+
+    run(invalidate_on_another_worker())
+
+    assert not banks.is_fresh()
+
+
+def test_broadcast_invalidate_bumps_version(sessionmaker):
+    import reference_cache
+    from models.user.reference_versions import ReferenceVersion
+    from sqlalchemy import select
+
+    async def invalidate_twice():
+        async with sessionmaker() as session:
+            await reference_cache.broadcast_invalidate(session, "schools")
+            await reference_cache.broadcast_invalidate(session, "schools")
+            query = select(ReferenceVersion.version).where(
+                ReferenceVersion.name == "schools"
+            )
+            return await session.scalar(query)
+
+    assert run(invalidate_twice()) == 2
+    assert not reference_cache.schools.is_fresh()
+
+
+def test_load_failure_answers_error_envelope(client, monkeypatch):
+    import reference_cache
+
+    async def failing_load(db=None):
+        raise RuntimeError("lost connection")
+
+    monkeypatch.setattr(reference_cache.schools, "load", failing_load)
+    reference_cache.schools.invalidate()
+
+    result = client.get("/user/school/name", headers=auth_headers(1))
+
+    assert result.status_code == 200
+    assert result.json()["settings"] == {
+        "message": "lost connection",
+        "status": 400,
+        "success": 0,
+    }
@@ -0,0 +1,60 @@
+"""Read-your-writes pinning to the primary"""
+
+import pytest
+
+from conftest import add_rows, run
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    import db
+
+    monkeypatch.setattr(db, "replica_engines", ["replica"])
+    monkeypatch.setattr(db, "_primary_pins", {})
+    return db
+
+
+def test_delete_pins_user(sessionmaker, replica):
+    from api_crud import delete
+    from models.user.user_references import UserReferenceIfo
+
+    reference = UserReferenceIfo(
+        id=1, user_id=7, name="A", mobile="9999999999", relation="friend"
+    )
+    add_rows(sessionmaker, reference)
+
+    async def delete_reference():
+        async with sessionmaker() as session:
+            with replica.track_primary_pin() as pin:
+                await delete(1, UserReferenceIfo, session)
+            return pin
+
+    pin = run(delete_reference())
+
+    assert pin.until is not None
+    assert replica.is_pinned_to_primary(7)
+
+
+def test_bulk_insert_pins_users(sessionmaker, replica):
+    from api_crud import bulk_create_items
+    from models.user.user_references import UserReferenceIfo
+
+    items = [
+        {"user_id": 8, "name": "A", "mobile": "9999999999", "relation": "friend"},
+        {"user_id": 9, "name": "B", "mobile": "8888888888", "relation": "friend"},
+    ]
+
+    async def insert_references():
+        async with sessionmaker() as session:
+            with replica.track_primary_pin() as pin:
+                response_obj = await bulk_create_items(
+                    UserReferenceIfo, items, session
+                )
+            return response_obj, pin
+
+    response_obj, pin = run(insert_references())
+
+    assert response_obj.settings["status"] == 201
+    assert pin.until is not None
+    assert replica.is_pinned_to_primary(8)
+    assert replica.is_pinned_to_primary(9)
@@ -0,0 +1,30 @@
+"""Revocation list refresh"""
+
+import logging
+
+from conftest import run
+
+
+def test_missing_table_logs_one_error(sessionmaker, caplog, monkeypatch):
+    import revocation
+    from sqlalchemy import text
+
+    async def drop_table():
+        async with sessionmaker() as session:
+            await session.execute(text("DROP TABLE revoked_tokens"))
+            await session.commit()
+
+    run(drop_table())
+    monkeypatch.setattr(revocation, "AsyncSessionLocal", sessionmaker)
+    revocations = revocation.RevocationList()
+
+    async def refresh_three_times():
+        for _ in range(3):
+            await revocations.refresh()
+
+    with caplog.at_level(logging.ERROR, logger="revocation"):
+        run(refresh_three_times())
+
+    assert revocations.failing
+    assert len(caplog.records) == 1
+    assert "revoked_tokens" in caplog.records[0].getMessage()
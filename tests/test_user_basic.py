@@ -0,0 +1,67 @@
+"""GET /user/basic"""
+
+from datetime import date, datetime, timedelta
+
+from conftest import add_rows, auth_headers
+
+
+def add_user(sessionmaker):
+    from models.user.basic_details import UserPersonalInfo
+    from models.user.users import Users
+
+    written_at = datetime.utcnow() - timedelta(days=1)
+    add_rows(
+        sessionmaker,
+        Users(
+            id=1,
+            full_name="Test User",
+            mobile="9999999999",
+            email="a@b.in",
+            modified_at=written_at,
+        ),
+    )
+    add_rows(
+        sessionmaker,
+        UserPersonalInfo(
+            user_id=1,
+            father_name="Father",
+            mother_name="Mother",
+            dob=date(1990, 1, 1),
+            address="Address",
+            pincode=560001,
+            modified_at=written_at,
+        ),
+    )
+
+
+def test_user_fields_come_from_token_claims(client, sessionmaker):
+    add_user(sessionmaker)
+
+    result = client.get("/user/basic?user_id=1", headers=auth_headers(1))
+
+    assert result.status_code == 200
+    assert result.json()["data"]["result"]["full_name"] == "Test User"
+    assert result.json()["data"]["result"]["email"] == "a@b.in"
+    # user_details only, users is not read again
+    assert result.headers["X-DB-Query-Count"] == "1"
+
+
+def test_conditional_request_probes_both_rows(client, sessionmaker):
+    add_user(sessionmaker)
+    first = client.get("/user/basic?user_id=1", headers=auth_headers(1))
+
+    headers = {**auth_headers(1), "If-None-Match": first.headers["ETag"]}
+    result = client.get("/user/basic?user_id=1", headers=headers)
+
+    assert result.status_code == 304
+    assert result.headers["X-DB-Query-Count"] == "2"
+
+
+def test_user_fields_read_from_users_without_usable_claims(client, sessionmaker):
+    add_user(sessionmaker)
+    headers = auth_headers(1, email="dummy@gmail.com")
+
+    result = client.get("/user/basic?user_id=1", headers=headers)
+
+    assert result.json()["data"]["result"]["email"] == "a@b.in"
+    assert result.headers["X-DB-Query-Count"] == "2"
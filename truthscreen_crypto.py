@@ -0,0 +1,130 @@
+"""TruthScreen request/response envelope"""
+
+import os
+import json
+import base64
+import hashlib
+import logging
+from dotenv import load_dotenv
+
+import metrics
+import http_clients
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # pragma: no cover
+    Cipher = None
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRUTHSCREEN_URL = "https://www.truthscreen.com/v1/apicall"
+
+# remote: TruthScreen encrypt/decrypt endpoints (default)
+# local: envelope built in process, remote used when that fails
+# shadow: remote result used, local one computed alongside and compared
+TRUTHSCREEN_CRYPTO = os.getenv("TRUTHSCREEN_CRYPTO", "remote").lower()
+
+# API token the envelope key is derived from
+TRUTH_SCREEN_TOKEN = os.getenv("TRUTH_SCREEN_TOKEN")
+
+local_calls = metrics.counter("truthscreen.crypto.local")
+remote_calls = metrics.counter("truthscreen.crypto.remote")
+local_failures = metrics.counter("truthscreen.crypto.local_failures")
+shadow_matches = metrics.counter("truthscreen.crypto.shadow_matches")
+shadow_mismatches = metrics.counter("truthscreen.crypto.shadow_mismatches")
+
+
+def local_available() -> bool:
+    return Cipher is not None and bool(TRUTH_SCREEN_TOKEN)
+
+
+def envelope_key(token: str) -> bytes:
+    """AES-128 key, the first 16 hex characters of sha512(token)"""
+    return hashlib.sha512(token.encode()).hexdigest()[:16].encode()
+
+
+def encrypt(plaintext: str, token: str) -> str:
+    """AES-128-CBC envelope, "base64(ciphertext):base64(iv)" """
+    iv = os.urandom(16)
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(plaintext.encode()) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(envelope_key(token)), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(padded) + encryptor.finalize()
+    return f"{base64.b64encode(ciphertext).decode()}:{base64.b64encode(iv).decode()}"
+
+
+def decrypt(body: str, token: str) -> str:
+    """Plaintext of an envelope, or of a {"responseData": envelope} body"""
+    envelope = body.strip()
+    if envelope.startswith("{"):
+        envelope = json.loads(envelope)["responseData"]
+    encoded_ciphertext, encoded_iv = envelope.strip('"').split(":")
+    decryptor = Cipher(
+        algorithms.AES(envelope_key(token)), modes.CBC(base64.b64decode(encoded_iv))
+    ).decryptor()
+    padded = decryptor.update(base64.b64decode(encoded_ciphertext))
+    padded += decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return (unpadder.update(padded) + unpadder.finalize()).decode()
+
+
+async def remote(headers, endpoint, payload) -> str:
+    """Envelope from the TruthScreen encrypt/decrypt endpoints"""
+    remote_calls.inc()
+    url = f"{TRUTHSCREEN_URL}/{endpoint}"
+    result = await http_clients.request(
+        "truthscreen", "POST", url, headers=headers, content=payload
+    )
+    return result.text
+
+
+def local(endpoint, payload) -> str:
+    local_calls.inc()
+    if endpoint == "encrypt":
+        return encrypt(payload, TRUTH_SCREEN_TOKEN)
+    return decrypt(payload, TRUTH_SCREEN_TOKEN)
+
+
+def shadow(endpoint, payload, remote_result):
+    """Check the local envelope against what the remote endpoint returned.
+
+    Encryption uses a random IV, so the remote ciphertext is checked by
+    decrypting it locally instead of by comparison.
+    """
+    try:
+        if endpoint == "encrypt":
+            matches = decrypt(remote_result, TRUTH_SCREEN_TOKEN) == payload
+        else:
+            matches = json.loads(local(endpoint, payload)) == json.loads(remote_result)
+    except Exception as exc:
+        matches = False
+        msg = f"truthscreen shadow {endpoint} exception {str(exc)}"
+        logger.warning(msg)
+    if matches:
+        shadow_matches.inc()
+    else:
+        shadow_mismatches.inc()
+        logger.warning(f"truthscreen shadow {endpoint} mismatch")
+
+
+async def envelope(headers, endpoint, payload) -> str:
+    """Encrypt a request payload or decrypt a response body"""
+    if TRUTHSCREEN_CRYPTO == "local" and local_available():
+        try:
+            result = local(endpoint, payload)
+            if endpoint == "decrypt":
+                json.loads(result)
+            return result
+        except Exception as exc:
+            local_failures.inc()
+            msg = f"truthscreen local {endpoint} exception {str(exc)}"
+            logger.exception(msg)
+
+    result = await remote(headers, endpoint, payload)
+    if TRUTHSCREEN_CRYPTO == "shadow" and local_available():
+        shadow(endpoint, payload, result)
+    return result
@@ -0,0 +1,92 @@
+"""Request user context from verified token claims"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+import metrics
+from api_crud import get_single, get_modified_at
+from models.user.users import Users
+
+
+load_dotenv()
+
+# Email put in tokens of users who have not given one yet
+PLACEHOLDER_EMAIL = "dummy@gmail.com"
+
+USER_FIELDS = ["full_name", "mobile", "email"]
+
+# Users written by this process, newest last, with the write time
+USER_UPDATES_SIZE = int(os.getenv("USER_UPDATES_SIZE", "10000"))
+_updated_at = OrderedDict()
+
+claims_used = metrics.counter("user_context.claims")
+db_reads = metrics.counter("user_context.db")
+
+
+def mark_updated(user_id):
+    """Record a write to the user's row, older token claims are stale"""
+    key = str(user_id)
+    _updated_at[key] = time.time()
+    _updated_at.move_to_end(key)
+    if len(_updated_at) > USER_UPDATES_SIZE:
+        _updated_at.popitem(last=False)
+
+
+def as_timestamp(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def claims_user(token_data, user_id, modified_at: datetime = None):
+    """User fields taken from the token claims, None when they can't be trusted"""
+    if token_data is None or str(token_data.user_id) != str(user_id):
+        return None
+    if not token_data.full_name or not token_data.email:
+        return None
+    if token_data.email == PLACEHOLDER_EMAIL:
+        return None
+
+    # Claims reflect the row at issue time, any later write makes them stale
+    issued_at = token_data.iat
+    if issued_at is None:
+        return None
+    updated_at = _updated_at.get(str(user_id))
+    if updated_at is not None and updated_at >= issued_at:
+        return None
+    if modified_at is not None and as_timestamp(modified_at) >= issued_at:
+        return None
+
+    return {
+        "id": token_data.user_id,
+        "full_name": token_data.full_name,
+        "mobile": token_data.mobile,
+        "email": token_data.email,
+    }
+
+
+async def get_user(token_data, user_id, db, fresh=False, modified_at=None):
+    """full_name, mobile and email of the user, from the claims when they are
+    current and from users otherwise.
+
+    fresh checks users.modified_at against the token's iat first, for
+    callers that must not act on a name or email changed on another worker.
+    A modified_at the caller already read can be passed instead.
+    """
+    if fresh and modified_at is None and claims_user(token_data, user_id):
+        modified_at = await get_modified_at(Users, db, user_id)
+        if modified_at is None:
+            return None
+
+    user = claims_user(token_data, user_id, modified_at)
+    if user is not None:
+        claims_used.inc()
+        return user
+
+    db_reads.inc()
+    response_obj = await get_single(Users, db, user_id, columns=USER_FIELDS)
+    result = response_obj.data["result"]
+    return dict(result) if result else None
@@ -1,14 +1,39 @@
 """Util file"""
 
+import os
+import orjson
+import hashlib
+from decimal import Decimal
 from pydantic import BaseModel
 from collections import OrderedDict
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from sqlalchemy import inspect
+from starlette.requests import Request
+from starlette.responses import Response as HTTPResponse
 
 
 class Response(BaseModel):
     data: dict
     settings: dict
 
+
+class FastJSONResponse(HTTPResponse):
+    """JSON response rendered with orjson"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content, default=encode_value, option=orjson.OPT_NON_STR_KEYS
+        )
+
+
+_table_columns = {}
+
+# Seconds clients may reuse reference data before revalidating
+REFERENCE_MAX_AGE = int(os.getenv("REFERENCE_MAX_AGE", "300"))
+
 ALLOWED_IMAGE_TYPES = [
     "image/jpeg",
     "image/png",
@@ -34,3 +59,107 @@ def sort_emi_dates(emi_dates):
     return OrderedDict(
         sorted(emi_dates.items(), key=lambda x: datetime.strptime(x[0], "%d-%b-%Y"))
     )
+
+
+def encode_value(value):
+    """Encode the values orjson does not handle natively"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if hasattr(value, "__table__"):
+        return serialize_model(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def serialize_model(obj) -> dict:
+    """Loaded column values of a table model, column list computed once per
+    model; unloaded (load_only) columns are left out"""
+    model = type(obj)
+    columns = _table_columns.get(model)
+    if columns is None:
+        columns = _table_columns[model] = [
+            attr.key for attr in inspect(model).column_attrs
+        ]
+    values = obj.__dict__
+    return {column: values[column] for column in columns if column in values}
+
+
+def serialize_result(result):
+    """Table models in a response result as plain dicts"""
+    if isinstance(result, list):
+        return [serialize_result(item) for item in result]
+    if hasattr(result, "__table__"):
+        return serialize_model(result)
+    return result
+
+
+def render(response_obj: Response) -> FastJSONResponse:
+    """Render a response envelope without going through jsonable_encoder"""
+    data = dict(response_obj.data)
+    data["result"] = serialize_result(data.get("result"))
+    return FastJSONResponse({"data": data, "settings": response_obj.settings})
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag from a hash of the response body"""
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == opaque
+        for candidate in (candidate.strip() for candidate in header.split(","))
+    )
+
+
+def etag_response(
+    request: Request,
+    body: bytes,
+    etag: str,
+    cache_control=f"private, max-age={REFERENCE_MAX_AGE}",
+) -> HTTPResponse:
+    """Rendered JSON body with ETag, or 304 when the client has it"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return HTTPResponse(status_code=304, headers=headers)
+    return HTTPResponse(body, media_type="application/json", headers=headers)
+
+
+def row_validators(tag, modified_at: datetime) -> dict:
+    """Last-Modified and weak ETag headers for a row version, at the
+    one second resolution of the modified_at columns"""
+    if modified_at.tzinfo is None:
+        modified_at = modified_at.replace(tzinfo=timezone.utc)
+    modified_at = modified_at.astimezone(timezone.utc).replace(microsecond=0)
+    return {
+        "Last-Modified": format_datetime(modified_at, usegmt=True),
+        "ETag": f'W/"{tag}-{int(modified_at.timestamp())}"',
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def is_not_modified(request: Request, validators: dict) -> bool:
+    """Whether the client's copy matches the validators"""
+    if "if-none-match" in request.headers:
+        return etag_matches(request, validators["ETag"])
+    try:
+        since = parsedate_to_datetime(request.headers["if-modified-since"])
+        last_modified = parsedate_to_datetime(validators["Last-Modified"])
+        return last_modified <= since
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def not_modified_response(validators: dict) -> HTTPResponse:
+    return HTTPResponse(status_code=304, headers=validators)
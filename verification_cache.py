@@ -0,0 +1,105 @@
+"""Cache of third-party verification results"""
+
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+
+# Identifiers are only kept as HMACs under this salt; without one set a
+# random salt is used, which is enough for a per-process cache
+VERIFICATION_CACHE_SALT = (
+    os.getenv("VERIFICATION_CACHE_SALT", "").encode() or os.urandom(32)
+)
+
+# Seconds a successful verification is reused
+VERIFICATION_CACHE_TTL = float(os.getenv("VERIFICATION_CACHE_TTL", "86400"))
+
+# Seconds a definitive failure (invalid PAN, invalid account) is reused
+VERIFICATION_NEGATIVE_TTL = float(os.getenv("VERIFICATION_NEGATIVE_TTL", "900"))
+
+VERIFICATION_CACHE_SIZE = int(os.getenv("VERIFICATION_CACHE_SIZE", "50000"))
+
+# Outcomes of a provider result
+VERIFIED = "verified"
+REJECTED = "rejected"
+
+
+class VerificationCache:
+    """Provider results by salted hash of the verified identifier.
+
+    Verified and definitively rejected results are kept for their TTLs,
+    anything else (provider errors) is never cached. Concurrent lookups of
+    the same identifier share one provider call.
+    """
+
+    def __init__(self, max_entries=VERIFICATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = metrics.counter("verification_cache.hits")
+        self.misses = metrics.counter("verification_cache.misses")
+        metrics.gauge("verification_cache.entries", lambda: len(self.entries))
+
+    @staticmethod
+    def key(kind, identifier) -> str:
+        message = f"{kind}:{identifier}".encode()
+        return hmac.new(VERIFICATION_CACHE_SALT, message, hashlib.sha256).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        result, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result, ttl):
+        self.entries[key] = (result, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def lookup(self, kind, identifier, fetch, outcome):
+        """Cached result for the identifier, or fetch() stored by outcome.
+
+        outcome(result) returns VERIFIED, REJECTED or None for results that
+        must not be reused.
+        """
+        key = self.key(kind, identifier)
+        result = self.get(key)
+        if result is not None:
+            self.hits.inc()
+            return result
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.hits.inc()
+            return await asyncio.shield(in_flight)
+
+        self.misses.inc()
+        in_flight = self._in_flight[key] = asyncio.ensure_future(fetch())
+        try:
+            result = await asyncio.shield(in_flight)
+        finally:
+            self._in_flight.pop(key, None)
+
+        verdict = outcome(result)
+        if verdict == VERIFIED:
+            self.put(key, result, VERIFICATION_CACHE_TTL)
+        elif verdict == REJECTED:
+            self.put(key, result, VERIFICATION_NEGATIVE_TTL)
+        return result
+
+
+verification_cache = VerificationCache()